@@ -0,0 +1,33 @@
+from udot_border_route import compact_route_border_rule_rows
+
+
+def row(route_id, start, end, left_id, right_id):
+    return (route_id, start, end, left_id, right_id, "polyline", None, None, None)
+
+
+def compact(rows, tolerance=0, min_length=0):
+    return [compacted[:5] for compacted in compact_route_border_rule_rows(rows, tolerance, min_length)]
+
+
+def test_merge_touching_and_overlapping():
+    rows = [row("R1", 0, 10, "A", "B"), row("R1", 10, 20, "A", "B"), row("R1", 15, 25, "A", "B"), row("R2", 0, 5, "A", "B")]
+
+    assert compact(rows) == [("R1", 0, 25, "A", "B"), ("R2", 0, 5, "A", "B")]
+
+
+def test_merge_across_free_gap():
+    rows = [row("R1", 0, 10, "A", "B"), row("R1", 12, 20, "A", "B"), row("R1", 25, 30, "C", "D")]
+
+    assert compact(rows, tolerance=5) == [("R1", 0, 20, "A", "B"), ("R1", 25, 30, "C", "D")]
+
+
+def test_keep_gap_occupied_by_other_boundaries():
+    rows = [row("R1", 0, 10, "A", "B"), row("R1", 10, 20, "C", "D"), row("R1", 20, 30, "A", "B")]
+
+    assert compact(rows, tolerance=15) == [original[:5] for original in rows]
+
+
+def test_drop_short_spans():
+    rows = [row("R1", 0, 10, "A", "B"), row("R1", 10, 10.5, "C", "D")]
+
+    assert compact(rows, min_length=1) == [("R1", 0, 10, "A", "B")]
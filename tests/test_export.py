@@ -0,0 +1,40 @@
+import csv
+from datetime import datetime
+
+import pytest
+
+from udot_border_route import export_route_border_rule_rows, parse_date
+
+ROWS = [("R1", 0.0, 1.0, "A", "B", "polyline", "2015-01-01T00:00:00", None, datetime(2024, 5, 1)),
+        ("R2", 2.5, 4.0, "B", "C", "polyline", "2016-03-04", "2020-01-01T12:30:00", datetime(2024, 5, 1))]
+
+
+def test_parse_date():
+    assert parse_date("2015-01-01T00:00:00") == datetime(2015, 1, 1)
+    assert parse_date("2020-01-01T12:30:00.000") == datetime(2020, 1, 1, 12, 30)
+    assert parse_date("2016-03-04") == datetime(2016, 3, 4)
+    assert parse_date(None) is None
+    assert parse_date(datetime(2024, 5, 1)) == datetime(2024, 5, 1)
+
+
+def test_export_parquet_string_dates(tmp_path):
+    pyarrow_parquet = pytest.importorskip("pyarrow.parquet")
+
+    path = str(tmp_path / "rules.parquet")
+    export_route_border_rule_rows(ROWS, path)
+
+    table = pyarrow_parquet.read_table(path).to_pydict()
+    assert table["ROUTE_ID"] == ["R1", "R2"]
+    assert table["EFFECTIVE_FROM_DT"] == [datetime(2015, 1, 1), datetime(2016, 3, 4)]
+    assert table["EFFECTIVE_TO_DT"] == [None, datetime(2020, 1, 1, 12, 30)]
+    assert table["BRP_PROCESS_DT"] == [datetime(2024, 5, 1), datetime(2024, 5, 1)]
+
+
+def test_export_csv(tmp_path):
+    path = str(tmp_path / "rules.csv")
+    export_route_border_rule_rows(ROWS, path)
+
+    with open(path) as csv_file:
+        records = list(csv.DictReader(csv_file))
+    assert [record["ROUTE_ID"] for record in records] == ["R1", "R2"]
+    assert records[1]["EFFECTIVE_FROM_DT"] == "2016-03-04"
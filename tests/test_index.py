@@ -0,0 +1,49 @@
+import pytest
+
+from udot_border_route_index import build_index, RuleTableIndex
+
+ROWS = {"ROUTE_COUNTY_RULE_SRC": [("0015P", 0.0, 10.0, "A", "B"),
+                                  ("0015P", 10.0, 25.0, "B", "C"),
+                                  ("0089N", 5.0, 2.0, "C", None),
+                                  (None, 0.0, 1.0, "A", "B")],
+        "ROUTE_CITY_RULE_SRC": [("0015P", 3.0, 4.0, "X", "Y")]}
+
+
+@pytest.fixture
+def index(tmp_path):
+    path = str(tmp_path / "rules.bri")
+    build_index(path, ROWS)
+    return RuleTableIndex(path)
+
+
+def test_lookup(index):
+    sides = index.lookup(["0015P", "0015P", "0015P", "0015P", "0089N", "0089N", "0015P"], [0.0, 10.0, 12.5, 30.0, 3.0, 6.0, 3.5])
+
+    assert list(sides["ROUTE_COUNTY_RULE_SRC"][0]) == ["A", "B", "B", None, "C", None, "A"]
+    assert list(sides["ROUTE_COUNTY_RULE_SRC"][1]) == ["B", "C", "C", None, None, None, "B"]
+    assert list(sides["ROUTE_CITY_RULE_SRC"][0]) == [None, None, None, None, None, None, "X"]
+
+
+def test_lookup_unknown_route(index):
+    sides = index.lookup(["0080P", "0015P-LONGER-THAN-ANY-ROUTE-ID"], [1.0, 1.0], levels=["ROUTE_COUNTY_RULE_SRC"])
+
+    assert list(sides["ROUTE_COUNTY_RULE_SRC"][0]) == [None, None]
+
+
+def test_lookup_overlapping_spans(tmp_path):
+    path = str(tmp_path / "rules.bri")
+    build_index(path, {"ROUTE_COUNTY_RULE_SRC": [("R", 0.0, 100.0, "A", "B"), ("R", 10.0, 20.0, "C", "D"), ("R", 30.0, 40.0, "E", "F")]})
+
+    left_ids, right_ids = RuleTableIndex(path).lookup(["R", "R", "R", "R"], [50.0, 15.0, 100.0, 101.0])["ROUTE_COUNTY_RULE_SRC"]
+
+    assert list(left_ids) == ["A", "C", "A", None]
+    assert list(right_ids) == ["B", "D", "B", None]
+
+
+def test_lookup_empty_index(tmp_path):
+    path = str(tmp_path / "rules.bri")
+    build_index(path, {"ROUTE_COUNTY_RULE_SRC": []})
+
+    left_ids, right_ids = RuleTableIndex(path).lookup(["R"], [1.0])["ROUTE_COUNTY_RULE_SRC"]
+
+    assert list(left_ids) == [None]
@@ -0,0 +1,35 @@
+import pytest
+
+shapely = pytest.importorskip("shapely")
+
+from udot_border_route_shapely import get_route_lines, generate_route_border_rule_rows
+
+# two counties sharing a border along x = 100
+BOUNDARIES = [(shapely.box(-100, -100, 100, 200), {"COUNTY_ID": "A"}),
+              (shapely.box(100, -100, 300, 200), {"COUNTY_ID": "B"})]
+
+
+def generate_rows(routes):
+    return [row[:5] for row in generate_route_border_rule_rows(get_route_lines(routes, "ROUTE_ID"), BOUNDARIES, "COUNTY_ID",
+                                                               buffer_size=5, high_angle_threshold=45, offset=2)]
+
+
+def test_looping_route():
+    # crosses the border at a high angle, loops back and runs south along the border, crossing its first pass at
+    # distance 51, the pass along the border is located where it is traversed, 194 to 284
+    route = shapely.LineString([(50, 50), (150, 50), (150, 95), (101, 95), (101, 5)])
+
+    assert generate_rows([(route, {"ROUTE_ID": "R1"})]) == [
+        ("R1", 190.0, 193.0, "B", "B"),
+        ("R1", 193.0, 284.0, "B", "A"),
+    ]
+
+
+def test_route_without_id():
+    routes = [(shapely.LineString([(101, 10), (101, 60)]), {"ROUTE_ID": "R1"}),
+              (shapely.LineString([(99, 10), (99, 60)]), {"ROUTE_ID": None})]
+
+    assert generate_rows(routes) == [
+        (None, 0.0, 50.0, "A", "B"),
+        ("R1", 0.0, 50.0, "A", "B"),
+    ]
@@ -0,0 +1,29 @@
+from udot_border_route import stitch_route_border_rule_rows
+
+
+def row(route_id, start, end, left_id="A", right_id="B"):
+    return (route_id, start, end, left_id, right_id, "polyline", None, None, None)
+
+
+def stitch(tile_rows, tolerance=0.001):
+    return [stitched[:5] for stitched in stitch_route_border_rule_rows(tile_rows, tolerance)]
+
+
+def test_stitch_rows_cut_at_seams():
+    tile_rows = [(row("R1", 0, 10), 0), (row("R1", 10, 20), 1), (row("R1", 10, 20), 0), (row("R1", 20, 30, "C", "D"), 1)]
+
+    assert stitch(tile_rows) == [("R1", 0, 20, "A", "B"), ("R1", 20, 30, "C", "D")]
+
+
+def test_keep_touching_rows_of_one_tile():
+    assert stitch([(row("R1", 0, 10), 0), (row("R1", 10, 20), 0)]) == [("R1", 0, 10, "A", "B"), ("R1", 10, 20, "A", "B")]
+
+
+def test_stitch_decreasing_measures():
+    assert stitch([(row("R1", 500, 450), 0), (row("R1", 450, 400), 1)]) == [("R1", 500, 400, "A", "B")]
+
+
+def test_rows_without_route_id_or_measures():
+    tile_rows = [(row("R1", 0, 10), 0), (row(None, 1, 2), 0), (row("R1", None, 3), 1)]
+
+    assert stitch(tile_rows) == [(None, 1, 2, "A", "B"), ("R1", None, 3, "A", "B"), ("R1", 0, 10, "A", "B")]
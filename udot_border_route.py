@@ -1,17 +1,62 @@
 __author__ = 'wzhang'
 
-import arcpy
 import os
 import sys
 import math
+import shutil
+import tempfile
+import time
+import json
+import hashlib
+import multiprocessing
+import numpy
 import logging
 import logging.config
 import logging.handlers
 from datetime import datetime
 import traceback
+import fnmatch
+import cProfile
+import pstats
+import heapq
+import pickle
+import csv
+import itertools
+import bisect
+
+try:
+    import arcpy
+except ImportError:
+    # only the shapely backend is available
+    arcpy = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    # rule tables are exported as CSV only
+    pyarrow = None
 
 logger = logging.getLogger(__name__)
 
+ROUTE_BORDER_RULE_TABLE_FIELDS = ["ROUTE_ID","ROUTE_START_MEASURE","ROUTE_END_MEASURE","BOUNDARY_LEFT_ID","BOUNDARY_RIGHT_ID",
+                                  "SEGMENT_GEOMETRY","EFFECTIVE_FROM_DT","EFFECTIVE_TO_DT","BRP_PROCESS_DT"]
+
+LINEAR_UNITS_IN_METERS = {"inches": 0.0254, "feet": 0.3048, "ussurveyfeet": 1200.0 / 3937, "yards": 0.9144, "miles": 1609.344,
+                          "nauticalmiles": 1852.0, "millimeters": 0.001, "centimeters": 0.01, "decimeters": 0.1, "meters": 1.0,
+                          "kilometers": 1000.0}
+
+# rule table rows sorted in memory, more are sorted by an external merge sort
+SORT_MAX_ROWS_IN_MEMORY = 1000000
+
+# boundary state row of the run parameters rule table rows are generated with, see get_boundary_fingerprints
+RUN_PARAMETERS_STATE = "RUN_PARAMETERS"
+
 def main():
     setup_logger()
 
@@ -19,6 +64,49 @@ def main():
     config = get_parameters()
     section = "Default"
 
+    if get_parameter(config, section, "BACKEND", "arcpy").lower() == "shapely":
+        # run through the backend entry, it instruments through the imported udot_border_route, not this script
+        import udot_border_route_shapely
+        return udot_border_route_shapely.main()
+
+    run_with_report(config, section, run)
+
+
+def run_with_report(config, section, run, output_path=None):
+    """
+    Run a backend with instrumentation, writing the run report, and the profile if PROFILE is set, next to tss.log
+    unless output_path is given.
+    """
+    output_path = output_path or os.path.dirname(os.path.realpath(__file__))
+    # drop records of a previous run in this process, e.g. of a batch job
+    run_report.pop_records()
+    run_report.started = time.time()
+    run_report.configure(get_parameter(config, section, "INSTRUMENT", "True").lower() == "true",
+                         get_parameter(config, section, "INSTRUMENT_VERTICES", "False").lower() == "true")
+
+    profiler = cProfile.Profile() if get_parameter(config, section, "PROFILE", "False").lower() == "true" else None
+    if profiler:
+        profiler.enable()
+
+    try:
+        return run(config, section)
+    finally:
+        if profiler:
+            profiler.disable()
+            write_profile(profiler, os.path.join(output_path, "tss_profile.prof"))
+
+        if run_report.enabled:
+            run_report.end_stage()
+            run_report.write(os.path.join(output_path, "tss_report_{0}.json".format(datetime.now().strftime("%Y%m%d_%H%M%S"))))
+            for line in run_report.summary():
+                logger.info(line)
+            run_report.restore()
+
+
+def run(config, section):
+    if not arcpy:
+        sys.exit("arcpy is not available, set BACKEND=shapely to run without it. Exit")
+
     workspace = config.get(section, "WORKSPACE")
     route = config.get(section, "ROUTE")
     route_id_field = config.get(section,"ROUTE_ID_FIELD")
@@ -28,14 +116,59 @@ def main():
     buffer_size  = config.get(section, "BUFFER_SIZE")
     high_angle_threshold  = float(config.get(section, "HIGH_ANGLE_THRESHOLD"))
     offset  = config.get(section, "OFFSET")
+    workers = int(get_parameter(config, section, "WORKERS", 1))
+    cache_folder = get_parameter(config, section, "CACHE_FOLDER")
+    cache_max_entries = int(get_parameter(config, section, "CACHE_MAX_ENTRIES", 24))
+    cache_max_size_mb = float(get_parameter(config, section, "CACHE_MAX_SIZE_MB", 4096))
+    cache_refresh = get_parameter(config, section, "CACHE_REFRESH", "False").lower() == "true"
+    scratch_workspace = get_parameter(config, section, "SCRATCH_WORKSPACE")
+    scratch_memory_budget_mb = float(get_parameter(config, section, "SCRATCH_MEMORY_BUDGET_MB", 2048))
+    keep_intermediates = get_parameter(config, section, "KEEP_INTERMEDIATES", "")
+    debug = get_parameter(config, section, "DEBUG", "False").lower() == "true"
+    generalize_tolerance_fraction = float(get_parameter(config, section, "GENERALIZE_TOLERANCE_FRACTION", 0))
+    generalize_validate = get_parameter(config, section, "GENERALIZE_VALIDATE", "False").lower() == "true"
+    generalize_measure_tolerance = get_parameter(config, section, "GENERALIZE_MEASURE_TOLERANCE")
+    incremental = get_parameter(config, section, "INCREMENTAL", "False").lower() == "true"
+    route_state_table = get_parameter(config, section, "ROUTE_STATE_TABLE", "{0}_BORDER_ROUTE_STATE".format(route))
+    tile_size = float(get_parameter(config, section, "TILE_SIZE", 0))
+    tile_overlap = float(get_parameter(config, section, "TILE_OVERLAP", 0))
+    export_folder = get_parameter(config, section, "EXPORT_FOLDER")
+    checkpoint_folder = get_parameter(config, section, "CHECKPOINT_FOLDER")
+    index_path = get_parameter(config, section, "INDEX_PATH")
+    shared_arcs = get_parameter(config, section, "SHARED_ARCS", "False").lower() == "true"
+    compact = get_parameter(config, section, "COMPACT", "True").lower() == "true"
+    compact_tolerance = float(get_parameter(config, section, "COMPACT_TOLERANCE", 0))
+    compact_min_length = float(get_parameter(config, section, "COMPACT_MIN_LENGTH", 0))
+    export_format = get_parameter(config, section, "EXPORT_FORMAT", "csv").lower()
+
+    # spans split by the pipeline, and by tiles, are merged into the minimal set of spans per route as rows are written
+    compaction = (compact_tolerance,compact_min_length) if compact else None
 
     boundaries = boundaries.split(",")
     boundaries_id_fields = boundaries_id_fields.split(",")
     route_border_rule_tables = route_border_rule_tables.split(",")
 
+    if export_folder and export_format == "parquet" and not pyarrow:
+        sys.exit("pyarrow is not available, set EXPORT_FORMAT=csv to export rule tables. Exit")
+
+    # differences are measured along routes, in measure units, which have nothing to do with the linear unit of offset
+    if generalize_tolerance_fraction > 0 and generalize_validate and not generalize_measure_tolerance:
+        sys.exit("Set GENERALIZE_MEASURE_TOLERANCE, in route measure units, to validate generalization. Exit")
+
     arcpy.env.workspace = workspace
     arcpy.env.overwriteOutput = True
 
+    # cache of boundary and route preprocessing outputs
+    cache = PreprocessCache(cache_folder,cache_max_entries,cache_max_size_mb,cache_refresh) if cache_folder else None
+
+    if scratch_workspace == "in_memory" and not psutil:
+        logger.warning("psutil is not installed, SCRATCH_MEMORY_BUDGET_MB is checked against peak memory, and not at all on Windows")
+
+    # location of intermediates, only rule tables, intermediates asked to keep and diagnostic outputs in debug mode are
+    # written to workspace
+    scratch = ScratchWorkspace(workspace,scratch_workspace,scratch_memory_budget_mb,[pattern.strip() for pattern in keep_intermediates.split(",") if pattern.strip()],
+                               None,debug)
+
     # generate route border rule source tables
 
     # boundary = boundaries[1]
@@ -45,310 +178,760 @@ def main():
     # arcpy.AddMessage("Working on {0} and {1}".format(route,boundary))
     # generate_route_border_rule_table(workspace,route,route_id_field,boundary,boundary_id_field,buffer_size,route_border_rule_table,high_angle_threshold,offset)
 
-    for boundary in boundaries:
-        index = boundaries.index(boundary)
-        boundary_id_field = boundaries_id_fields[index]
-        route_border_rule_table = route_border_rule_tables[index]
+    jobs = list(zip(boundaries, boundaries_id_fields, route_border_rule_tables))
+
+    # the pipeline runs on generalized copies of boundaries, much fewer vertices within a fraction of offset
+    full_precision_jobs = jobs
+    if generalize_tolerance_fraction > 0:
+        run_report.begin_stage("generalize_boundaries")
+        jobs = generalize_boundaries(workspace,jobs,generalize_tolerance_fraction,offset)
+
+    # incremental mode needs the route state and rule tables of a previous run, otherwise everything is generated
+    route_state_table = os.path.join(workspace,route_state_table)
+    run_report.begin_stage("route_fingerprints" if incremental else None)
+    route_fingerprints = get_route_fingerprints(route,route_id_field) if incremental else None
+    boundary_fingerprints = get_boundary_fingerprints(full_precision_jobs,[route_id_field,buffer_size,high_angle_threshold,offset,compact,compact_tolerance,
+                                                                            compact_min_length,generalize_tolerance_fraction]) if incremental else None
+    incremental = incremental and arcpy.Exists(route_state_table) and \
+                  all(arcpy.Exists(os.path.join(workspace,route_border_rule_table)) for route_border_rule_table in route_border_rule_tables)
+
+    # rows of unchanged routes are only valid on unchanged boundaries, generated with unchanged run parameters
+    changed_route_ids = None
+    if incremental:
+        changed_boundaries = get_changed_boundaries(route_state_table,boundary_fingerprints)
+        if changed_boundaries:
+            logger.warning("{0} changed since the last run, regenerating all route border rule source tables".format(",".join(changed_boundaries)))
+            incremental = False
+        else:
+            run_report.begin_stage("changed_routes")
+            changed_route_ids = get_changed_route_ids(route_state_table,route_fingerprints)
+
+    # checkpoints resume the pipeline stages of every boundary of serial and parallel runs. Intermediates of incremental,
+    # tiled and shared arc runs are in workspaces removed when they end, and run-level stages (generalization,
+    # validation, export, index) run again
+    if checkpoint_folder:
+        if incremental or tile_size > 0 or (shared_arcs and len(jobs) > 1):
+            logger.warning("CHECKPOINT_FOLDER is ignored by incremental, tiled and shared arc runs, stages are not checkpointed")
+            checkpoint_folder = None
+        else:
+            logger.info("Checkpointing pipeline stages of every boundary in {0}, run-level stages are not checkpointed".format(checkpoint_folder))
+
+    try:
+        if incremental:
+            failures = generate_route_border_rule_tables_incrementally(workspace,route,route_id_field,jobs,buffer_size,high_angle_threshold,offset,
+                                                                       changed_route_ids,scratch,compaction)
+        elif tile_size > 0:
+            failures = generate_route_border_rule_tables_by_tiles(workspace,route,route_id_field,jobs,buffer_size,high_angle_threshold,offset,tile_size,tile_overlap,workers,scratch,
+                                                                  compaction)
+        elif shared_arcs and len(jobs) > 1:
+            # boundary arcs, candidate clip and angle test are shared by all boundaries
+            run_report.begin_stage("route_buffer")
+            route_buffer = get_route_buffer(scratch,route,buffer_size,cache)
+            failures = generate_route_border_rule_tables_on_shared_arcs(workspace,route,route_id_field,jobs,buffer_size,high_angle_threshold,offset,route_buffer,cache,scratch,
+                                                                        compaction)
+        elif workers > 1 and len(jobs) > 1:
+            # route buffer is shared by all boundaries
+            run_report.begin_stage("route_buffer")
+            route_buffer = get_route_buffer(scratch,route,buffer_size,cache)
+            failures = generate_route_border_rule_tables_in_parallel(workspace,route,route_id_field,jobs,buffer_size,high_angle_threshold,offset,route_buffer,workers,cache,scratch,
+                                                                     checkpoint_folder,compaction)
+        else:
+            run_report.begin_stage("route_buffer")
+            route_buffer = get_route_buffer(scratch,route,buffer_size,cache)
+            failures = []
+            for boundary, boundary_id_field, route_border_rule_table in jobs:
+                if not generate_route_border_rule_table(workspace,route,route_id_field,boundary,boundary_id_field,buffer_size,route_border_rule_table,high_angle_threshold,offset,
+                                                        route_buffer,cache,scratch,None,checkpoint_folder,compaction=compaction):
+                    sys.exit("Failed when generating border route rule source table for {0} feature. Exit".format(boundary))
+
+        if failures:
+            sys.exit("Failed when generating border route rule source table for {0} feature. Exit".format(",".join(failures)))
+
+        # rule tables on generalized boundaries against a full-precision run
+        if generalize_tolerance_fraction > 0 and generalize_validate:
+            run_report.begin_stage("validate_generalization")
+            validate_generalization(workspace,route,route_id_field,full_precision_jobs,buffer_size,high_angle_threshold,offset,float(generalize_measure_tolerance),
+                                    cache,scratch,compaction)
+
+        # checkpoints are only needed to resume a failed run
+        if checkpoint_folder:
+            StageCheckpoints.clear(checkpoint_folder)
+
+        if route_fingerprints is not None:
+            run_report.begin_stage("route_state")
+            write_route_state(route_state_table,route_fingerprints,boundary_fingerprints)
+
+        if export_folder:
+            for route_border_rule_table in route_border_rule_tables:
+                run_report.begin_stage("{0}.export".format(route_border_rule_table))
+                export_path = os.path.join(export_folder,"{0}.{1}".format(route_border_rule_table,export_format))
+                export_route_border_rule_rows(read_route_border_rule_rows(os.path.join(workspace,route_border_rule_table)),export_path)
+                logger.info("Exported {0} to {1}".format(route_border_rule_table, export_path))
+
+        # lookup index of all rule tables, for downstream jobs
+        if index_path:
+            import udot_border_route_index
+            run_report.begin_stage("index")
+            udot_border_route_index.build_index(index_path,dict((route_border_rule_table,read_route_border_rule_rows(os.path.join(workspace,route_border_rule_table)))
+                                                                for route_border_rule_table in route_border_rule_tables))
+    finally:
+        # evict only after all boundaries are done, so no worker loses an entry in use
+        if cache:
+            cache.evict()
+        scratch.clear()
+        scratch.delete_local_workspace()
+
+        # generalized copies of boundaries are intermediates too
+        for boundary, boundary_id_field, route_border_rule_table in jobs:
+            if boundary.endswith("_GENERALIZED") and not scratch.kept(boundary) and arcpy.Exists(os.path.join(workspace,boundary)):
+                arcpy.Delete_management(os.path.join(workspace,boundary))
+
+
+def generate_route_border_rule_tables_incrementally(workspace,route,route_id_field,jobs,buffer_size,high_angle_threshold,offset,changed_route_ids,scratch=None,compaction=None):
+    """
+    Regenerate rule table rows of routes changed since the last run, and replace their rows in the rule tables.
+    The pipeline runs on a delta geodatabase holding changed routes and boundary polygons near them under their own
+    names, so it works on them unchanged.
+    @param changed_route_ids: routes added, edited or deleted since the last run, see get_changed_route_ids
+    @param compaction: (tolerance, min length) rows are compacted with, see compact_route_border_rule_rows, None to
+    keep them as they are. All rows of changed routes are replaced, so compacting them compacts their routes.
+    @return: boundaries failed
+    """
+    if not changed_route_ids:
+        arcpy.AddMessage("No route changed since last run")
+        return []
+
+    arcpy.AddMessage("Regenerating route border rule source tables for {0} changed routes...".format(len(changed_route_ids)))
+
+    delta_folder = tempfile.mkdtemp(prefix="border_route_delta_")
+    delta_workspace = arcpy.CreateFileGDB_management(delta_folder, "delta.gdb").getOutput(0)
+    failures = []
+    try:
+        # changed routes, deleted ones are only removed from rule tables
+        changed_route = os.path.join(delta_workspace,route)
+        copy_features_by_ids(os.path.join(workspace,route),route_id_field,changed_route_ids,changed_route)
+        has_changed_route = int(arcpy.GetCount_management(changed_route).getOutput(0)) > 0
+
+        arcpy.env.workspace = delta_workspace
+        route_buffer = get_route_buffer(ScratchWorkspace(delta_workspace),route,buffer_size) if has_changed_route else None
+
+        # boundary sides are sampled twice the offset away from routes, which may be farther than buffer size
+        spatial_reference = arcpy.Describe(changed_route).spatialReference
+        search_distance = max(get_linear_distance(buffer_size,spatial_reference),2 * get_linear_distance(offset,spatial_reference))
+
+        for boundary, boundary_id_field, route_border_rule_table in jobs:
+            route_border_rule_table_delta = None
+
+            if has_changed_route:
+                # boundary polygons near changed routes
+                run_report.begin_stage("{0}.changed_route_boundary".format(boundary))
+                boundary_near_changed_route_lyr = "in_memory\\{0}_near_changed_route_lyr".format(boundary)
+                arcpy.MakeFeatureLayer_management(os.path.join(workspace,boundary), boundary_near_changed_route_lyr)
+                arcpy.SelectLayerByLocation_management(boundary_near_changed_route_lyr, "WITHIN_A_DISTANCE", changed_route, search_distance)
+                arcpy.CopyFeatures_management(boundary_near_changed_route_lyr, os.path.join(delta_workspace,boundary))
+
+                if int(arcpy.GetCount_management(os.path.join(delta_workspace,boundary)).getOutput(0)) > 0:
+                    route_border_rule_table_delta = generate_route_border_rule_table(delta_workspace,route,route_id_field,boundary,boundary_id_field,buffer_size,
+                                                                                     route_border_rule_table,high_angle_threshold,offset,route_buffer,None,scratch,
+                                                                                     compaction=compaction)
+                    if not route_border_rule_table_delta:
+                        failures.append(boundary)
+                        continue
+
+            run_report.begin_stage("{0}.upsert".format(boundary))
+            upsert_route_border_rule_rows(os.path.join(workspace,route_border_rule_table),route_border_rule_table_delta,changed_route_ids)
+            logger.info("Replaced rows of {0} changed routes in {1}".format(len(changed_route_ids), route_border_rule_table))
+    finally:
+        arcpy.env.workspace = workspace
+        shutil.rmtree(delta_folder, ignore_errors=True)
+
+    return failures
+
+
+def generate_route_border_rule_tables_by_tiles(workspace,route,route_id_field,jobs,buffer_size,high_angle_threshold,offset,tile_size,tile_overlap,workers,scratch=None,compaction=None):
+    """
+    Generate route border rule source tables tile by tile, in a process pool.
+    The extent of routes is split into a grid of tiles. Every tile runs the pipeline on routes and boundaries clipped to
+    the tile grown by the overlap, and keeps segments within the tile only. Segments cut at tile seams are stitched
+    back when the rule tables are written.
+    @param tile_size: tile width and height, in units of the route spatial reference
+    @param tile_overlap: overlap around tiles, at least BUFFER_SIZE and OFFSET, by default twice the larger of them
+    @param compaction: (tolerance, min length) stitched rows are compacted with, see compact_route_border_rule_rows,
+    None to keep them as they are
+    @return: boundaries failed
+    """
+    spatial_reference = arcpy.Describe(route).spatialReference
+    min_overlap = max(get_linear_distance(buffer_size,spatial_reference),get_linear_distance(offset,spatial_reference))
+    if tile_overlap < min_overlap:
+        if tile_overlap:
+            logger.warning("TILE_OVERLAP {0} is less than BUFFER_SIZE or OFFSET, using {1}".format(tile_overlap, 2 * min_overlap))
+        tile_overlap = 2 * min_overlap
+
+    tiles = get_tiles(arcpy.Describe(route).extent,tile_size)
+    tile_folder = tempfile.mkdtemp(prefix="border_route_tiles_")
+    tasks = [(workspace,tile_folder,tile_index,tile,tile_overlap,route,route_id_field,jobs,buffer_size,high_angle_threshold,offset,scratch,workers > 1)
+             for tile_index, tile in enumerate(tiles)]
+
+    arcpy.AddMessage("Generating route border rule source tables in {0} tiles with {1} workers...".format(len(tasks), max(1, workers)))
+    if workers > 1:
+        pool = create_process_pool(workers)
+        try:
+            results = pool.map(generate_tile_route_border_rule_tables_worker, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [generate_tile_route_border_rule_tables_worker(task) for task in tasks]
+
+    # instrumentation records of workers
+    for tile_index, tile_tables, tile_errors, records in results:
+        run_report.extend(records)
+    results = [(tile_index, tile_tables, tile_errors) for tile_index, tile_tables, tile_errors, records in results]
+
+    failures = []
+    try:
+        for boundary, boundary_id_field, route_border_rule_table in jobs:
+            errors = [tile_errors[key] for tile_index, tile_tables, tile_errors in results for key in (boundary, None) if key in tile_errors]
+            if errors:
+                logger.error("Failed when generating border route rule source table for {0} feature:\n{1}".format(boundary, "\n".join(errors)))
+                failures.append(boundary)
+                continue
+
+            # stitch segments of all tiles
+            run_report.begin_stage("{0}.stitch".format(boundary))
+            rows = []
+            for tile_index, tile_tables, tile_errors in results:
+                if boundary in tile_tables:
+                    rows.extend((row, tile_index) for row in read_route_border_rule_rows(tile_tables[boundary]))
+            rows = stitch_route_border_rule_rows(rows,spatial_reference.MTolerance)
+            if compaction:
+                rows = compact_route_border_rule_rows(rows,*compaction)
+
+            write_route_border_rule_rows(os.path.join(workspace,route_border_rule_table),rows)
+            logger.info("Committed {0} for {1} feature from {2} tiles".format(route_border_rule_table, boundary, len(tiles)))
+    finally:
+        shutil.rmtree(tile_folder, ignore_errors=True)
+
+    return failures
+
+
+def generate_tile_route_border_rule_tables_worker(task):
+    """
+    Generate rule tables of all boundaries for one tile, in a tile geodatabase holding routes and boundaries clipped to
+    the tile grown by the overlap, under their own names.
+    @return: (tile index, {boundary: rule table in tile geodatabase}, {boundary, or None for all: error message},
+              instrumentation records)
+    """
+    (workspace,tile_folder,tile_index,tile,tile_overlap,route,route_id_field,jobs,buffer_size,high_angle_threshold,offset,scratch,in_pool) = task
+    try:
+        run_report.begin_stage("tile_route")
+        arcpy.env.overwriteOutput = True
+        spatial_reference = arcpy.Describe(os.path.join(workspace,route)).spatialReference
+        xmin, ymin, xmax, ymax = tile
+        tile_extent = get_extent_polygon(xmin,ymin,xmax,ymax,spatial_reference)
+        process_extent = get_extent_polygon(xmin-tile_overlap,ymin-tile_overlap,xmax+tile_overlap,ymax+tile_overlap,spatial_reference)
+
+        tile_workspace = arcpy.CreateFileGDB_management(tile_folder, "tile_{0}.gdb".format(tile_index)).getOutput(0)
+        arcpy.Clip_analysis(os.path.join(workspace,route), process_extent, os.path.join(tile_workspace,route))
+        if int(arcpy.GetCount_management(os.path.join(tile_workspace,route)).getOutput(0)) == 0:
+            return tile_index, {}, {}, run_report.pop_records()
+
+        arcpy.env.workspace = tile_workspace
+        route_buffer = get_route_buffer(ScratchWorkspace(tile_workspace),route,buffer_size)
+
+        tile_tables = {}
+        tile_errors = {}
+        for boundary, boundary_id_field, route_border_rule_table in jobs:
+            run_report.begin_stage("{0}.tile_boundary".format(boundary))
+            arcpy.Clip_analysis(os.path.join(workspace,boundary), process_extent, os.path.join(tile_workspace,boundary))
+            if int(arcpy.GetCount_management(os.path.join(tile_workspace,boundary)).getOutput(0)) == 0:
+                continue
+
+            result = generate_route_border_rule_table(tile_workspace,route,route_id_field,boundary,boundary_id_field,buffer_size,route_border_rule_table,
+                                                      high_angle_threshold,offset,route_buffer,None,scratch,tile_extent)
+            if result:
+                tile_tables[boundary] = result
+            else:
+                tile_errors[boundary] = "Tile {0} failed, see log".format(tile_index)
+
+        return tile_index, tile_tables, tile_errors, run_report.pop_records()
+    except Exception:
+        return tile_index, {}, {None: "Tile {0} failed:\n{1}".format(tile_index, traceback.format_exc())}, run_report.pop_records()
+    finally:
+        # tiles run in the process of the run when there is one worker, whose tables are in workspace, and whose
+        # scratch geodatabase is deleted by the run
+        arcpy.env.workspace = workspace
+        if in_pool and scratch:
+            scratch.delete_local_workspace()
+
 
+def generate_route_border_rule_tables_in_parallel(workspace,route,route_id_field,jobs,buffer_size,high_angle_threshold,offset,route_buffer,workers,cache=None,scratch=None,checkpoint_folder=None,
+                                                  compaction=None):
+    """
+    Generate route border rule source tables of all boundaries in a process pool, one boundary per worker.
+    Every worker works in its own scratch file geodatabase, the rule tables are then committed into the workspace.
+    @return: boundaries failed
+    """
+    scratch_folder = tempfile.mkdtemp(prefix="border_route_")
+    tasks = [(workspace,scratch_folder,route,route_id_field,boundary,boundary_id_field,buffer_size,route_border_rule_table,high_angle_threshold,offset,route_buffer,cache,scratch,checkpoint_folder,
+              compaction)
+             for boundary, boundary_id_field, route_border_rule_table in jobs]
+
+    arcpy.AddMessage("Generating route border rule source tables with {0} workers...".format(min(workers, len(tasks))))
+    pool = create_process_pool(min(workers, len(tasks)))
+    try:
+        results = pool.map(generate_route_border_rule_table_worker, tasks)
+    finally:
+        pool.close()
+        pool.join()
+
+    failures = []
+    for (boundary, boundary_id_field, route_border_rule_table), (result, error, records) in zip(jobs, results):
+        run_report.extend(records)
+        if error:
+            logger.error("Failed when generating border route rule source table for {0} feature:\n{1}".format(boundary, error))
+            failures.append(boundary)
+            continue
 
-        if not generate_route_border_rule_table(workspace,route,route_id_field,boundary,boundary_id_field,buffer_size,route_border_rule_table,high_angle_threshold,offset):
-            sys.exit("Failed when generating border route rule source table for {0} feature. Exit")
+        # commit rule table into workspace
+        run_report.begin_stage("{0}.commit".format(boundary))
+        route_border_rule_table_path = os.path.join(workspace,route_border_rule_table)
+        if arcpy.Exists(route_border_rule_table_path):
+            arcpy.Delete_management(route_border_rule_table_path)
+        arcpy.Copy_management(result,route_border_rule_table_path)
+        logger.info("Committed {0} for {1} feature".format(route_border_rule_table, boundary))
 
+    shutil.rmtree(scratch_folder, ignore_errors=True)
 
-def generate_route_border_rule_table(workspace,route,route_id_field,boundary,boundary_id_field,buffer_size,route_border_rule_table,high_angle_threshold,offset):
-    arcpy.AddMessage("Generating route border rule source table for {1}...".format(boundary))
+    return failures
+
+
+def generate_route_border_rule_table_worker(task):
+    """
+    Process pool entry of generate_route_border_rule_table.
+    @return: (rule table in scratch workspace, None, instrumentation records) or (None, error message, instrumentation records)
+    """
+    (workspace,scratch_folder,route,route_id_field,boundary,boundary_id_field,buffer_size,route_border_rule_table,high_angle_threshold,offset,route_buffer,cache,scratch,checkpoint_folder,
+     compaction) = task
     try:
-        date = datetime.now()
-        date_string = date.strftime("%m/%d/%Y")
+        arcpy.env.workspace = workspace
+        arcpy.env.overwriteOutput = True
 
-        spatial_reference = arcpy.Describe(route).spatialReference
-        xy_resolution = "{0} {1}".format(spatial_reference.XYResolution,spatial_reference.linearUnitName)
+        scratch_workspace = arcpy.CreateFileGDB_management(scratch_folder, "{0}.gdb".format(boundary)).getOutput(0)
+        result = generate_route_border_rule_table(scratch_workspace,route,route_id_field,boundary,boundary_id_field,buffer_size,route_border_rule_table,high_angle_threshold,offset,
+                                                  route_buffer,cache,scratch,None,checkpoint_folder,compaction=compaction)
+        if not result:
+            return None, "generate_route_border_rule_table returned no result", run_report.pop_records()
 
-        ###############################################################################################################
-        # get all candidate border routes
-        arcpy.AddMessage("Identifying candidate border routes...")
+        return result, None, run_report.pop_records()
+    except Exception:
+        return None, traceback.format_exc(), run_report.pop_records()
+    finally:
+        # workers are pool processes, their scratch geodatabase is not the one of the run
+        if scratch:
+            scratch.delete_local_workspace()
 
-        # generate boundary border
-        boundary_border = os.path.join(workspace,"{0}_{1}_border".format(boundary,"boundary"))
-        arcpy.FeatureToLine_management(boundary, boundary_border)
 
-        # dissolve polygon boundary based on boundary id
-        boundary_border_dissolved = os.path.join(workspace,"{0}_boundary_border_dissolved".format(boundary))
-        arcpy.Dissolve_management(boundary_border,boundary_border_dissolved,[boundary_id_field])
+def generate_route_border_rule_tables_on_shared_arcs(workspace,route,route_id_field,jobs,buffer_size,high_angle_threshold,offset,route_buffer,cache=None,scratch=None,compaction=None):
+    """
+    Generate route border rule source tables of all boundaries from one planar arc graph of all of them.
+    Boundaries largely share edges, so arcs, their buffer and offset, the clip of routes near any border and the angles
+    of arcs within the route buffer are built once. Only this border linework is shared: every boundary then selects
+    the arcs flagged as its border, dissolves their buffer and offset into one polygon each, and runs the candidate
+    clip, the location of arcs along candidates and the side assignment of its own on the routes near any border.
+    Clipped by its border buffer, these are the candidates of all routes, and left and right boundary ids are
+    assigned from its own polygons.
+    @return: boundaries failed
+    """
+    arcpy.AddMessage("Building boundary arcs shared by {0}...".format(",".join(boundary for boundary, boundary_id_field, route_border_rule_table in jobs)))
 
-        # generate buffer around boundary
-        # arcpy.AddMessage("generate buffer around boundary")
-        boundary_border_buffer = os.path.join(workspace,"{0}_{1}".format(boundary,"boundary_buffer"))
-        arcpy.Buffer_analysis(boundary_border_dissolved, boundary_border_buffer, buffer_size, "FULL", "ROUND")
+    scratch = scratch.fork(workspace) if scratch else ScratchWorkspace(workspace)
+    failures = []
+    try:
+        run_report.begin_stage("shared_arcs")
+        arcs, arcs_buffer, arcs_offset = get_shared_boundary_arcs(scratch,jobs,buffer_size,offset,cache)
+
+        run_report.begin_stage("shared_candidate_border_routes")
+        route_near_border = scratch.path("{0}_near_border".format(route))
+        arcpy.Clip_analysis(route, arcs_buffer, route_near_border)
+
+        # the angle test of every arc within route buffer, once for all boundaries
+        run_report.begin_stage("shared_arc_angles")
+        arcs_within_route_buffer_multipart = scratch.path("boundary_arcs_within_{0}_buffer_multipart".format(route))
+        arcs_within_route_buffer = scratch.path("boundary_arcs_within_{0}_buffer".format(route))
+        arcpy.Clip_analysis(arcs, route_buffer, arcs_within_route_buffer_multipart)
+        arcpy.MultipartToSinglepart_management(arcs_within_route_buffer_multipart, arcs_within_route_buffer)
+        add_boundary_angles(arcs_within_route_buffer)
+
+        for boundary, boundary_id_field, route_border_rule_table in jobs:
+            # border of this boundary, selected from shared arcs by flag. Buffer and offset are dissolved by all flags,
+            # so the ones selected overlap where flags of other boundaries change, dissolve them into one polygon
+            run_report.begin_stage("{0}.shared_arcs".format(boundary))
+            boundary_border = []
+            for features, dissolve in ((arcs, False), (arcs_buffer, True), (arcs_offset, True), (arcs_within_route_buffer, False)):
+                boundary_features = scratch.path("{0}_{1}".format(boundary,os.path.basename(features)))
+                where_clause = "\"BORDER_{0}\" = 1".format(boundary)
+                if dissolve:
+                    boundary_features_selected = scratch.path("{0}_{1}_selected".format(boundary,os.path.basename(features)))
+                    arcpy.Select_analysis(features, boundary_features_selected, where_clause)
+                    arcpy.Dissolve_management(boundary_features_selected, boundary_features)
+                else:
+                    arcpy.Select_analysis(features, boundary_features, where_clause)
+                boundary_border.append(boundary_features)
+
+            if not generate_route_border_rule_table(workspace,route_near_border,route_id_field,boundary,boundary_id_field,buffer_size,route_border_rule_table,
+                                                    high_angle_threshold,offset,route_buffer,cache,scratch,None,None,boundary_border[:3],boundary_border[3],compaction):
+                failures.append(boundary)
+    finally:
+        scratch.clear()
+
+    return failures
+
+
+def get_route_buffer(scratch,route,buffer_size,cache=None):
+    """
+    Get flat buffer around routes, from cache if routes and buffer size are unchanged.
+    """
+    if not cache:
+        return generate_route_buffer(scratch,route,buffer_size)
 
-        # get candidate border route
-        # arcpy.AddMessage("get candidate border route")
-        candidate_border_route_multipart = "in_memory\\candidate_{0}_border_route_multipart".format(boundary)
-        candidate_border_route = os.path.join(workspace,"candidate_{0}_border_route".format(boundary))
-        arcpy.Clip_analysis(route, boundary_border_buffer, candidate_border_route_multipart)
-        arcpy.MultipartToSinglepart_management(candidate_border_route_multipart, candidate_border_route)
-        ################################################################################################################
+    return cache.get_or_create("route_buffer",[route],[buffer_size],
+                               lambda cache_workspace: [generate_route_buffer(ScratchWorkspace(cache_workspace),route,buffer_size)])[0]
 
 
-        ################################################################################################################
-        #  filter out candidate border routes that 'intersects' boundary at high angles
-        arcpy.AddMessage("Filtering out candidate border routes that 'intersects' boundary at high angles...")
+def generate_route_buffer(scratch,route,buffer_size):
+    # route buffer is shared by boundaries and workers, keep it out of memory
+    route_buffer = scratch.path("{0}_{1}".format(route,"buffer_flat"),allow_memory=False)
+    arcpy.Buffer_analysis(route, route_buffer, buffer_size, "FULL", "FLAT")
 
-        route_buffer = os.path.join(workspace,"{0}_{1}".format(route,"buffer_flat"))
-        if not arcpy.Exists(route_buffer):
-            arcpy.Buffer_analysis(route, route_buffer, buffer_size, "FULL", "FLAT")
+    return route_buffer
 
-        # clip boundary segments within route buffer
-        boundary_border_within_buffer_multipart = "in_memory\\{0}_boundary_within_{1}_buffer_multipart".format(boundary,route)
-        boundary_border_within_buffer = os.path.join(workspace,"{0}_boundary_within_{1}_buffer".format(boundary,route))
-        arcpy.Clip_analysis(boundary_border_dissolved, route_buffer, boundary_border_within_buffer_multipart)
-        arcpy.MultipartToSinglepart_management(boundary_border_within_buffer_multipart, boundary_border_within_buffer)
 
-        # Add 'SEGMENT_ID_ALL_CANDIDATES' field to candidate route and populate it with 'OBJECTID'
-        arcpy.AddField_management(candidate_border_route,"SEGMENT_ID_ALL_CANDIDATES","LONG")
-        arcpy.CalculateField_management(candidate_border_route, "SEGMENT_ID_ALL_CANDIDATES", "!OBJECTID!", "PYTHON")
+def get_boundary_border(scratch,boundary,boundary_id_field,buffer_size,offset,cache=None):
+    """
+    Get dissolved boundary border, its buffer and its offset, from cache if boundary and distances are unchanged.
+    @return: (boundary_border_dissolved, boundary_border_buffer, boundary_border_offset)
+    """
+    if not cache:
+        return generate_boundary_border(scratch,boundary,boundary_id_field,buffer_size,offset)
 
-        # Add 'ANGLE_ROUTE' field to candidate route and populate it with the angle to the true north(= 0 degree)
-        arcpy.AddField_management(candidate_border_route,"ANGLE_ROUTE","DOUBLE")
-        with arcpy.da.UpdateCursor(candidate_border_route,("SHAPE@","ANGLE_ROUTE")) as uCur:
-            for row in uCur:
-                shape = row[0]
-                x_first = shape.firstPoint.X
-                y_first = shape.firstPoint.Y
-                x_last = shape.lastPoint.X
-                y_last = shape.lastPoint.Y
+    return cache.get_or_create("boundary_border",[boundary],[boundary_id_field,buffer_size,offset],
+                               lambda cache_workspace: generate_boundary_border(ScratchWorkspace(cache_workspace),boundary,boundary_id_field,buffer_size,offset))
 
-                angle = calculate_angle(x_first,y_first,x_last,y_last)
 
-                if angle >=0:
-                    row[1]=angle
-                    uCur.updateRow(row)
+def generate_boundary_border(scratch,boundary,boundary_id_field,buffer_size,offset):
+    # generate boundary border
+    boundary_border = scratch.path("{0}_{1}_border".format(boundary,"boundary"))
+    arcpy.FeatureToLine_management(boundary, boundary_border)
 
-        # Add 'ANGLE_BOUNDARY' field to boundary segment within route buffer and populate it with the angle to the true north(= 0 degree)
-        arcpy.AddField_management(boundary_border_within_buffer,"ANGLE_BOUNDARY","DOUBLE")
-        with arcpy.da.UpdateCursor(boundary_border_within_buffer,("SHAPE@","ANGLE_BOUNDARY")) as uCur:
-            for row in uCur:
-                shape = row[0]
-                x_first = shape.firstPoint.X
-                y_first = shape.firstPoint.Y
-                x_last = shape.lastPoint.X
-                y_last = shape.lastPoint.Y
+    # dissolve polygon boundary based on boundary id
+    boundary_border_dissolved = scratch.path("{0}_boundary_border_dissolved".format(boundary))
+    arcpy.Dissolve_management(boundary_border,boundary_border_dissolved,[boundary_id_field])
 
-                angle = calculate_angle(x_first,y_first,x_last,y_last)
+    # generate buffer around boundary
+    boundary_border_buffer = scratch.path("{0}_{1}".format(boundary,"boundary_buffer"))
+    arcpy.Buffer_analysis(boundary_border_dissolved, boundary_border_buffer, buffer_size, "FULL", "ROUND")
 
-                if angle:
-                    row[1]=angle
-                    uCur.updateRow(row)
+    # generate offset around boundary
+    boundary_border_offset= scratch.path("{0}_{1}".format(boundary,"boundary_offset"))
+    arcpy.Buffer_analysis(boundary_border_dissolved, boundary_border_offset, offset, "FULL", "ROUND")
 
-        del uCur
+    return boundary_border_dissolved, boundary_border_buffer, boundary_border_offset
 
-        # locate boundary segment within buffer along candidate border route.
-        # assuming that if the boundary segment can't be located along its corresponding route, these two might have high angles.
-        boundary_along_candidate_border_route = os.path.join(workspace,"{0}_boundary_along_candidate_{1}_border_route".format(boundary,boundary))
-        arcpy.LocateFeaturesAlongRoutes_lr(boundary_border_within_buffer,candidate_border_route,"SEGMENT_ID_ALL_CANDIDATES",buffer_size,\
-                                           boundary_along_candidate_border_route,"{0} {1} {2} {3}".format("RID","LINE","FMEAS","TMEAS"))
 
-        arcpy.JoinField_management(boundary_along_candidate_border_route, "RID", candidate_border_route, "SEGMENT_ID_ALL_CANDIDATES", ["ANGLE_ROUTE"])
+def get_shared_boundary_arcs(scratch,jobs,buffer_size,offset,cache=None):
+    """
+    Get planar arcs shared by all boundaries, their buffer and their offset, from cache if boundaries and distances are
+    unchanged.
+    @return: (arcs, arcs_buffer, arcs_offset)
+    """
+    boundaries = [boundary for boundary, boundary_id_field, route_border_rule_table in jobs]
+    boundaries_id_fields = [boundary_id_field for boundary, boundary_id_field, route_border_rule_table in jobs]
+    if not cache:
+        return generate_shared_boundary_arcs(scratch,boundaries,boundaries_id_fields,buffer_size,offset)
+
+    return cache.get_or_create("shared_boundary_arcs",boundaries,boundaries_id_fields + [buffer_size,offset],
+                               lambda cache_workspace: generate_shared_boundary_arcs(ScratchWorkspace(cache_workspace),boundaries,boundaries_id_fields,buffer_size,offset))
+
+
+def generate_shared_boundary_arcs(scratch,boundaries,boundaries_id_fields,buffer_size,offset):
+    # overlay of all boundaries, every polygon of it is within at most one polygon of every boundary
+    boundaries_union = scratch.path("boundaries_union")
+    arcpy.Union_analysis(boundaries, boundaries_union, "ONLY_FID")
+
+    # every unique arc once, with the union polygons on its left and right, -1 outside of all
+    arcs = scratch.path("boundary_arcs")
+    arcpy.PolygonToLine_management(boundaries_union, arcs, "IDENTIFY_NEIGHBORS")
+
+    # boundary ids of union polygons
+    boundary_ids = []
+    for boundary, boundary_id_field in zip(boundaries, boundaries_id_fields):
+        with arcpy.da.SearchCursor(boundary, ["OID@", boundary_id_field]) as sCur:
+            boundary_ids.append(dict((row[0], row[1]) for row in sCur))
+    union_boundary_ids = {}
+    with arcpy.da.SearchCursor(boundaries_union, ["OID@"] + ["FID_{0}".format(os.path.basename(boundary)) for boundary in boundaries]) as sCur:
+        for row in sCur:
+            union_boundary_ids[row[0]] = [ids.get(fid) for ids, fid in zip(boundary_ids, row[1:])]
+    outside = [None] * len(boundaries)
+
+    # flag arcs as border of boundaries whose ids on their left and right differ
+    border_fields = ["BORDER_{0}".format(boundary) for boundary in boundaries]
+    for border_field in border_fields:
+        arcpy.AddField_management(arcs,border_field,"SHORT")
+    with arcpy.da.UpdateCursor(arcs, ["LEFT_FID","RIGHT_FID"] + border_fields) as uCur:
+        for row in uCur:
+            uCur.updateRow(list(row[:2]) + [int(left_id != right_id) for left_id, right_id in
+                                            zip(union_boundary_ids.get(row[0], outside), union_boundary_ids.get(row[1], outside))])
+
+    # generate buffer and offset around arcs, dissolved by the boundaries they are border of
+    arcs_buffer = scratch.path("boundary_arcs_buffer")
+    arcpy.Buffer_analysis(arcs, arcs_buffer, buffer_size, "FULL", "ROUND", "LIST", border_fields)
+    arcs_offset = scratch.path("boundary_arcs_offset")
+    arcpy.Buffer_analysis(arcs, arcs_offset, offset, "FULL", "ROUND", "LIST", border_fields)
+
+    return arcs, arcs_buffer, arcs_offset
+
+
+def generate_route_border_rule_table(workspace,route,route_id_field,boundary,boundary_id_field,buffer_size,route_border_rule_table,high_angle_threshold,offset,route_buffer=None,cache=None,scratch=None,clip_extent=None,checkpoint_folder=None,boundary_border=None,boundary_border_within_buffer=None,compaction=None):
+    arcpy.AddMessage("Generating route border rule source table for {0}...".format(boundary))
+
+    # intermediates of this boundary, cleared when done
+    scratch = scratch.fork(workspace) if scratch else ScratchWorkspace(workspace)
+    try:
+        date = datetime.now()
+        process_date = datetime(date.year, date.month, date.day)
 
+        spatial_reference = arcpy.Describe(route).spatialReference
 
-        positive_candidate_border_route = []
-        with arcpy.da.SearchCursor(boundary_along_candidate_border_route,("RID","ANGLE_ROUTE","ANGLE_BOUNDARY")) as sCur:
-            for row in sCur:
-                sid = str(row[0])
-                angle_route = row[1]
-                angle_boundary = row[2]
-
-                if angle_route and angle_boundary:
-                    delta_angle = abs(angle_route-angle_boundary)
-
-                    # get real intersecting angle
-                    if delta_angle > 90 and delta_angle <= 270:
-                        delta_angle = abs(180 - delta_angle)
-                    elif delta_angle > 270:
-                        delta_angle = 360 - delta_angle
-                    else:
-                        pass
-
-                    # filter out negative candidate border route
-                    if delta_angle <= high_angle_threshold:
-                        if sid not in positive_candidate_border_route:
-                            positive_candidate_border_route.append(sid)
-        del sCur
-
-        candidate_border_route_lyr = "in_memory\\candidate_border_route_lyr"
-        arcpy.MakeFeatureLayer_management(candidate_border_route, candidate_border_route_lyr)
-        candidate_border_route_positive = os.path.join(workspace,"candidate_{0}_border_route_positive".format(boundary))
-        where_clause = "\"{0}\" IN ({1})".format("OBJECTID",",".join(positive_candidate_border_route))
-        arcpy.SelectLayerByAttribute_management(candidate_border_route_lyr, "NEW_SELECTION", where_clause)
-        arcpy.CopyFeatures_management(candidate_border_route_lyr,candidate_border_route_positive)
-
-        candidate_border_route_negative = os.path.join(workspace,"candidate_{0}_border_route_negative".format(boundary))
-        where_clause = "\"{0}\" NOT IN ({1})".format("OBJECTID",",".join(positive_candidate_border_route))
-        arcpy.SelectLayerByAttribute_management(candidate_border_route_lyr, "NEW_SELECTION", where_clause)
-        arcpy.CopyFeatures_management(candidate_border_route_lyr,candidate_border_route_negative)
-        ################################################################################################################
-
-
-        ################################################################################################################
-        # get left, right boundary topology of positive candidate border route
-        # handle candidate border route segment with different L/R boundary id by offset
-        arcpy.AddMessage("Calculating L/R boundary topology of positive candidate border route...")
-
-        # generate offset around boundary
-        boundary_border_offset= os.path.join(workspace,"{0}_{1}".format(boundary,"boundary_offset"))
-        arcpy.Buffer_analysis(boundary_border_dissolved, boundary_border_offset, offset, "FULL", "ROUND")
-
-        # get intersections between positive candidate border route and boundary offset
-        candidate_border_route_positive_boundary_offset_intersections = os.path.join(workspace,"candidate_{0}_border_route_positive_{1}_offset_intersections".format(boundary,boundary))
-        arcpy.Intersect_analysis([candidate_border_route_positive,boundary_border_offset], candidate_border_route_positive_boundary_offset_intersections, "ALL", "", "point")
-
-        # split positive candidate border route by intersections generated above
-        candidate_border_route_positive_splitted_by_offset = os.path.join(workspace,"candidate_{0}_border_route_positive_splitted_by_offset".format(boundary))
-        arcpy.SplitLineAtPoint_management(candidate_border_route_positive,candidate_border_route_positive_boundary_offset_intersections,\
-                                          candidate_border_route_positive_splitted_by_offset,xy_resolution)
-
-        # Add 'SEGMENT_ID_POSITIVE_CANDIDATES' field to splitted positive candidate route and populate it with 'OBJECTID'
-        arcpy.AddField_management(candidate_border_route_positive_splitted_by_offset,"SEGMENT_ID_POSITIVE_CANDIDATES","LONG")
-        arcpy.CalculateField_management(candidate_border_route_positive_splitted_by_offset, "SEGMENT_ID_POSITIVE_CANDIDATES", "!OBJECTID!", "PYTHON")
-
-        # get positive candidate border route segments that within boundary offset
-        candidate_border_route_positive_within_offset = os.path.join(workspace,"candidate_{0}_border_route_positive_within_offset".format(boundary))
-        candidate_border_route_positive_splitted_by_offset_lyr = "in_memory\\candidate_{0}_border_route_positive_splitted_by_offset_lyr".format(boundary)
-        arcpy.MakeFeatureLayer_management(candidate_border_route_positive_splitted_by_offset, candidate_border_route_positive_splitted_by_offset_lyr)
-        arcpy.SelectLayerByLocation_management (candidate_border_route_positive_splitted_by_offset_lyr, "WITHIN", boundary_border_offset)
-        arcpy.CopyFeatures_management(candidate_border_route_positive_splitted_by_offset_lyr,candidate_border_route_positive_within_offset)
-
-        # get positive candidate border route segments that out of boundary offset
-        candidate_border_route_positive_outof_offset = os.path.join(workspace,"candidate_{0}_border_route_positive_outof_offset".format(boundary))
-        arcpy.SelectLayerByAttribute_management(candidate_border_route_positive_splitted_by_offset_lyr, "SWITCH_SELECTION")
-        arcpy.CopyFeatures_management(candidate_border_route_positive_splitted_by_offset_lyr,candidate_border_route_positive_outof_offset)
-
-        # generate offset around positive candidate border route within boundary offset
-        # arcpy.AddMessage("generate offset around boundary")
-        candidate_border_route_positive_within_offset_buffer= os.path.join(workspace,"candidate_{0}_border_route_positive_within_offset_buffer".format(boundary))
-        arcpy.Buffer_analysis(candidate_border_route_positive_within_offset, candidate_border_route_positive_within_offset_buffer, offset, "FULL", "FLAT")
-
-        # clip boundary segments within offset distance from positive candidate route that within boundary offset
-        boundary_border_within_positive_candidate_border_route_buffer_multipart = "in_memory\\{0}_boundary_within_positive_candidate_border_route_buffer_multipart".format(boundary)
-        boundary_border_within_positive_candidate_border_route_buffer = os.path.join(workspace,"{0}_boundary_within_positive_candidate_border_route_buffer".format(boundary))
-        arcpy.Clip_analysis(boundary_border_dissolved, candidate_border_route_positive_within_offset_buffer, boundary_border_within_positive_candidate_border_route_buffer_multipart)
-        arcpy.MultipartToSinglepart_management(boundary_border_within_positive_candidate_border_route_buffer_multipart, boundary_border_within_positive_candidate_border_route_buffer)
-
-        # get endpoints of boundary border within offset buffer of splitted positive candidate border routes
-        boundary_border_within_positive_candidate_border_route_buffer_endpoints = os.path.join(workspace,"{0}_boundary_within_positive_candidate_border_route_buffer_endpoints".format(boundary))
-        arcpy.FeatureVerticesToPoints_management(boundary_border_within_positive_candidate_border_route_buffer,\
-                                                 boundary_border_within_positive_candidate_border_route_buffer_endpoints,"BOTH_ENDS")
-        arcpy.DeleteIdentical_management(boundary_border_within_positive_candidate_border_route_buffer_endpoints, ["Shape"])
-
-        # split boundary border within offset buffer of splitted positive candidate border routes and endpoints location
-        # then delete identical shape
-        boundary_border_within_positive_candidate_border_route_buffer_splitted_by_own_endpoints = os.path.join(workspace,"{0}_boundary_within_positive_candidate_border_route_buffer_splitted_by_own_endpoints".format(boundary))
-        arcpy.SplitLineAtPoint_management(boundary_border_within_positive_candidate_border_route_buffer,boundary_border_within_positive_candidate_border_route_buffer_endpoints,\
-                                          boundary_border_within_positive_candidate_border_route_buffer_splitted_by_own_endpoints,xy_resolution)
-        arcpy.DeleteIdentical_management(boundary_border_within_positive_candidate_border_route_buffer_splitted_by_own_endpoints, ["Shape"])
-
-        # Add 'SEGMENT_ID_BOUNDARY' field to boundary segments within offset distance from positive candidate route that within boundary offset and populate it with 'OBJECTID'
-        arcpy.AddField_management(boundary_border_within_positive_candidate_border_route_buffer_splitted_by_own_endpoints,"SEGMENT_ID_BOUNDARY","LONG")
-        arcpy.CalculateField_management(boundary_border_within_positive_candidate_border_route_buffer_splitted_by_own_endpoints, "SEGMENT_ID_BOUNDARY", "!OBJECTID!", "PYTHON")
-
-        # locate boundary segments within offset distance of positive candidate route that within boundary offset along positive candidate route that within boundary offset
-        boundary_border_within_positive_candidate_border_route_buffer_along_candidate_border_route = os.path.join(workspace,"{0}_boundary_border_within_positive_candidate_border_route_buffer_along_candidate_border_route".format(boundary))
-        arcpy.LocateFeaturesAlongRoutes_lr(boundary_border_within_positive_candidate_border_route_buffer_splitted_by_own_endpoints,candidate_border_route_positive_within_offset,"SEGMENT_ID_POSITIVE_CANDIDATES",offset,\
-                                           boundary_border_within_positive_candidate_border_route_buffer_along_candidate_border_route,"{0} {1} {2} {3}".format("RID","LINE","FMEAS","TMEAS"))
-
-        # get left, right boundary topology of boundary within offset distance of positive candidate route that within boundary offset along positive candidate route that within boundary offset
-        boundary_border_within_positive_candidate_border_route_buffer_with_polygon_topology_allcases= os.path.join(workspace,"{0}_boundary_border_within_positive_candidate_border_route_buffer_with_{1}_topology_allcases".format(boundary,boundary))
-        arcpy.Identity_analysis(boundary_border_within_positive_candidate_border_route_buffer_splitted_by_own_endpoints, boundary, boundary_border_within_positive_candidate_border_route_buffer_with_polygon_topology_allcases,"ALL","","KEEP_RELATIONSHIPS")
-
-        boundary_border_within_positive_candidate_border_route_buffer_with_polygon_topology_allcases_lyr = "in_memory\\{0}_boundary_border_within_positive_candidate_border_route_buffer_with_{1}_topology_allcases_lyr".format(boundary,boundary)
-        arcpy.MakeFeatureLayer_management(boundary_border_within_positive_candidate_border_route_buffer_with_polygon_topology_allcases, boundary_border_within_positive_candidate_border_route_buffer_with_polygon_topology_allcases_lyr)
-
-        where_clause = "\"{0}\"<>0 AND \"{1}\"<>0".format("LEFT_{0}".format(boundary),"RIGHT_{0}".format(boundary))
-        arcpy.SelectLayerByAttribute_management(boundary_border_within_positive_candidate_border_route_buffer_with_polygon_topology_allcases_lyr, "NEW_SELECTION", where_clause)
-        boundary_border_within_positive_candidate_border_route_buffer_with_polygon_topology = os.path.join(workspace,"{0}_boundary_border_within_positive_candidate_border_route_buffer_with_{1}_topology".format(boundary,boundary))
-        arcpy.CopyFeatures_management(boundary_border_within_positive_candidate_border_route_buffer_with_polygon_topology_allcases_lyr,boundary_border_within_positive_candidate_border_route_buffer_with_polygon_topology)
-
-        arcpy.JoinField_management(boundary_border_within_positive_candidate_border_route_buffer_along_candidate_border_route,"SEGMENT_ID_BOUNDARY",\
-                                   boundary_border_within_positive_candidate_border_route_buffer_with_polygon_topology,"SEGMENT_ID_BOUNDARY",["LEFT_{0}".format(boundary_id_field),"RIGHT_{0}".format(boundary_id_field)])
-
-        arcpy.JoinField_management(candidate_border_route_positive_within_offset,"SEGMENT_ID_POSITIVE_CANDIDATES",\
-                                   boundary_border_within_positive_candidate_border_route_buffer_along_candidate_border_route,"RID",["SEGMENT_ID_BOUNDARY","LEFT_{0}".format(boundary_id_field),"RIGHT_{0}".format(boundary_id_field)])
-
-        candidate_border_route_positive_within_offset_lyr = "in_memory\\candidate_{0}_border_route_positive_within_offset_lyr".format(boundary)
-        arcpy.MakeFeatureLayer_management(candidate_border_route_positive_within_offset, candidate_border_route_positive_within_offset_lyr)
-        where_clause = "\"{0}\"IS NOT NULL AND \"{1}\"IS NOT NULL".format("LEFT_{0}".format(boundary_id_field),"RIGHT_{0}".format(boundary_id_field))
-        arcpy.SelectLayerByAttribute_management(candidate_border_route_positive_within_offset_lyr, "NEW_SELECTION", where_clause)
-        candidate_border_route_positive_within_offset_with_polygon_topology = os.path.join(workspace,"candidate_{0}_border_route_positive_within_offset_with_{1}_topology".format(boundary,boundary))
-        arcpy.CopyFeatures_management(candidate_border_route_positive_within_offset_lyr,candidate_border_route_positive_within_offset_with_polygon_topology)
-
-        # get left, right boundary topology of candidate border route out of boundary offset
-        candidate_border_route_positive_outof_offset_with_polygon_topology_allcases= os.path.join(workspace,"candidate_{0}_border_route_positive_outof_offset_with_{1}_topology_allcases".format(boundary,boundary))
-        arcpy.Identity_analysis(candidate_border_route_positive_outof_offset, boundary, candidate_border_route_positive_outof_offset_with_polygon_topology_allcases,"ALL","","KEEP_RELATIONSHIPS")
-
-        candidate_border_route_positive_outof_offset_with_polygon_topology_allcases_lyr = "in_memory\\candidate_{0}_border_route_positive_outof_offset_with_polygon_topology_allcases_lyr".format(boundary)
-        arcpy.MakeFeatureLayer_management(candidate_border_route_positive_outof_offset_with_polygon_topology_allcases, candidate_border_route_positive_outof_offset_with_polygon_topology_allcases_lyr)
-        where_clause = "\"{0}\"<>0 AND \"{1}\"<>0".format("LEFT_{0}".format(boundary),"RIGHT_{0}".format(boundary))
-        arcpy.SelectLayerByAttribute_management(candidate_border_route_positive_outof_offset_with_polygon_topology_allcases_lyr, "NEW_SELECTION", where_clause)
-        candidate_border_route_positive_outof_offset_with_polygon_topology = os.path.join(workspace,"candidate_{0}_border_route_positive_outof_offset_with_{1}_topology".format(boundary,boundary))
-        arcpy.CopyFeatures_management(candidate_border_route_positive_outof_offset_with_polygon_topology_allcases_lyr,candidate_border_route_positive_outof_offset_with_polygon_topology)
-
-        # merge
-        candidate_border_route_positive_with_polygon_topology = "candidate_{0}_border_route_positive_with_{1}_topology".format(boundary,boundary)
-        arcpy.FeatureClassToFeatureClass_conversion(candidate_border_route_positive_outof_offset_with_polygon_topology,workspace,candidate_border_route_positive_with_polygon_topology)
-        arcpy.Append_management([candidate_border_route_positive_within_offset_with_polygon_topology],candidate_border_route_positive_with_polygon_topology,"NO_TEST")
-
-        ################################################################################################################
-
-
-        ################################################################################################################
-        arcpy.AddMessage("Populate route_border_rule_table...")
-
-        # calculate from measure and to measure of candidate border route
-        # arcpy.AddMessage("Calculating from measure and to measure of candidate border routes...")
-        arcpy.AddGeometryAttributes_management(candidate_border_route_positive_with_polygon_topology, "LINE_START_MID_END")
-
-        # get candidte border route segment geometry
-        arcpy.AddField_management(candidate_border_route_positive_with_polygon_topology,"SEGMENT_GEOMETRY","TEXT","","",100)
-        arcpy.CalculateField_management(candidate_border_route_positive_with_polygon_topology,"SEGMENT_GEOMETRY","!shape.type!","PYTHON")
-
-        # sort candidate border route segments based on route id and from measure, orderly
-        # arcpy.AddMessage("sort validated output got above based on route id and from measure, orderly")
-        candidate_border_route_positive_with_polygon_topology_sorted = os.path.join(workspace,"candidate_{0}_border_route_positive_with_polygon_topology_sorted".format(boundary))
-        arcpy.Sort_management(candidate_border_route_positive_with_polygon_topology,candidate_border_route_positive_with_polygon_topology_sorted,[[route_id_field,"ASCENDING"],["START_M","ASCENDING"]])
-
-        # create route_border_rule_table
-        if arcpy.Exists(route_border_rule_table):
-            arcpy.Delete_management(route_border_rule_table)
-            create_route_border_rule_table_schema(workspace,route_border_rule_table)
-        else:
-            create_route_border_rule_table_schema(workspace,route_border_rule_table)
+        # stage outputs are checkpointed, so a failed run resumes from the first incomplete stage
+        checkpoints = StageCheckpoints(checkpoint_folder,boundary,[route,boundary],[route_id_field,boundary_id_field,buffer_size,high_angle_threshold,offset,compaction]) \
+            if checkpoint_folder else None
 
-        # populate route_border_rule_table
-        iCur = arcpy.da.InsertCursor(route_border_rule_table,["ROUTE_ID","ROUTE_START_MEASURE","ROUTE_END_MEASURE","BOUNDARY_LEFT_ID",\
-                                                              "BOUNDARY_RIGHT_ID","SEGMENT_GEOMETRY","EFFECTIVE_FROM_DT","EFFECTIVE_TO_DT"])
-        with arcpy.da.SearchCursor(candidate_border_route_positive_with_polygon_topology_sorted,[route_id_field,"START_M","END_M","LEFT_{0}".format(boundary_id_field),\
-                                                                              "RIGHT_{0}".format(boundary_id_field),"SEGMENT_GEOMETRY","START_DATE","END_DATE"]) as sCur:
-            for row in sCur:
-                iCur.insertRow(row)
+        # stages with the datasets they consume and produce, only the ones needed for the rule table run, and the
+        # diagnostic ones in debug mode
+        pipeline = Pipeline(scratch.debug)
 
-        del sCur
-        del iCur
+        # generate boundary border, buffer and offset around it, unless derived from shared boundary arcs
+        pipeline.stage("boundary_border",[],["boundary_border_dissolved","boundary_border_buffer","boundary_border_offset"],\
+            lambda output_scratch: list(boundary_border or get_boundary_border(output_scratch,boundary,boundary_id_field,buffer_size,offset,cache)),
+            "Identifying candidate border routes...")
+
+        # get all candidate border routes
+        pipeline.stage("candidate_border_routes",["boundary_border_buffer"],["candidate_border_route"],\
+            lambda output_scratch, boundary_border_buffer: [get_candidate_border_routes(scratch,output_scratch,route,boundary,boundary_border_buffer)])
 
-        arcpy.CalculateField_management(route_border_rule_table, "BRP_PROCESS_DT", "'{0}'".format(date_string), "PYTHON")
-        ################################################################################################################
+        # filter out candidate border routes that 'intersects' boundary at high angles
+        pipeline.stage("filter_candidate_border_routes",["boundary_border_dissolved","candidate_border_route"],["candidate_border_route_positive"],\
+            lambda output_scratch, boundary_border_dissolved, candidate_border_route: [filter_candidate_border_routes(scratch,output_scratch,route,boundary,
+                boundary_border_dissolved,candidate_border_route,route_buffer,buffer_size,high_angle_threshold,cache,boundary_border_within_buffer)],
+            "Filtering out candidate border routes that 'intersects' boundary at high angles...")
+
+        pipeline.stage("candidate_border_routes_negative",["candidate_border_route","candidate_border_route_positive"],["candidate_border_route_negative"],\
+            lambda output_scratch, candidate_border_route, candidate_border_route_positive: [select_diagnostic_features(scratch,candidate_border_route,
+                "candidate_{0}_border_route_negative".format(boundary),"\"{0}\" = 0".format("POSITIVE_CANDIDATE"))],
+            diagnostic=True)
+
+        # get left, right boundary topology of positive candidate border route
+        # handle candidate border route segment with different L/R boundary id by offset
+        pipeline.stage("boundary_topology",["candidate_border_route_positive","boundary_border_offset"],["candidate_border_route_positive_splitted_by_offset"],\
+            lambda output_scratch, candidate_border_route_positive, boundary_border_offset: [assign_boundary_sides(scratch,output_scratch,boundary,boundary_id_field,
+                candidate_border_route_positive,boundary_border_offset,offset,spatial_reference)],
+            "Calculating L/R boundary topology of positive candidate border route...")
+
+        pipeline.stage("boundary_topology_both_sides",["candidate_border_route_positive_splitted_by_offset"],["candidate_border_route_positive_with_polygon_topology"],\
+            lambda output_scratch, route_segments: [select_diagnostic_features(scratch,route_segments,
+                "candidate_{0}_border_route_positive_with_{1}_topology".format(boundary,boundary),get_both_sides_where_clause(boundary_id_field))],
+            diagnostic=True)
+
+        # segments with boundary on both sides are read by the rule table stage directly, not copied before
+        pipeline.stage("route_border_rule_table",["candidate_border_route_positive_splitted_by_offset"],["route_border_rule_table"],\
+            lambda output_scratch, route_segments: [populate_route_border_rule_table(scratch,workspace,route_id_field,boundary,boundary_id_field,
+                route_segments,route_border_rule_table,process_date,clip_extent,compaction)],
+            "Populate route_border_rule_table...")
+
+        def run_pipeline_stage(stage,build):
+            if stage.message:
+                arcpy.AddMessage(stage.message)
+            run_report.begin_stage("{0}.{1}".format(boundary,stage.name))
+            # diagnostic outputs are written where they are kept, not checkpointed
+            return build(scratch) if stage.diagnostic else run_stage(checkpoints,stage.name,scratch,build)
+
+        route_border_rule_table, = pipeline.run(["route_border_rule_table"],run_pipeline_stage)
 
         arcpy.AddMessage("done!")
 
         return route_border_rule_table
     except Exception:
-        # arcpy.AddMessage(traceback.format_exc())
-        sys.exit(traceback.format_exc())
+        # report failure to the caller, which decides whether to exit
+        logger.error(traceback.format_exc())
         return False
+    finally:
+        run_report.begin_stage("{0}.clear_scratch".format(boundary))
+        scratch.clear()
+        run_report.end_stage()
+
+
+def run_stage(checkpoints,stage,scratch,build):
+    """
+    Outputs of a pipeline stage, from its checkpoint if it is complete, built otherwise.
+    @param build: function that takes the scratch workspace for outputs of the stage and returns them
+    """
+    if not checkpoints:
+        return build(scratch)
+
+    return checkpoints.run(stage,build)
+
+
+def get_candidate_border_routes(scratch,output_scratch,route,boundary,boundary_border_buffer):
+    # get candidate border route
+    candidate_border_route_multipart = scratch.path("candidate_{0}_border_route_multipart".format(boundary))
+    candidate_border_route = output_scratch.path("candidate_{0}_border_route".format(boundary))
+    arcpy.Clip_analysis(route, boundary_border_buffer, candidate_border_route_multipart)
+    arcpy.MultipartToSinglepart_management(candidate_border_route_multipart, candidate_border_route)
+
+    # Add 'SEGMENT_ID_ALL_CANDIDATES' field to candidate route and populate it with 'OBJECTID'
+    arcpy.AddField_management(candidate_border_route,"SEGMENT_ID_ALL_CANDIDATES","LONG")
+    arcpy.CalculateField_management(candidate_border_route, "SEGMENT_ID_ALL_CANDIDATES", "!OBJECTID!", "PYTHON")
+
+    return candidate_border_route
+
+
+def filter_candidate_border_routes(scratch,output_scratch,route,boundary,boundary_border_dissolved,candidate_border_route,route_buffer,buffer_size,high_angle_threshold,cache=None,
+                                   boundary_border_within_buffer=None):
+    """
+    @param boundary_border_within_buffer: boundary segments within route buffer with their ANGLE_BOUNDARY, e.g. shared
+    boundary arcs measured once for all boundaries, clipped from boundary_border_dissolved if not given
+    """
+    if not boundary_border_within_buffer:
+        if not route_buffer:
+            route_buffer = get_route_buffer(scratch,route,buffer_size,cache)
+
+        # clip boundary segments within route buffer
+        boundary_border_within_buffer_multipart = scratch.path("{0}_boundary_within_{1}_buffer_multipart".format(boundary,os.path.basename(route)))
+        boundary_border_within_buffer = scratch.path("{0}_boundary_within_{1}_buffer".format(boundary,os.path.basename(route)))
+        arcpy.Clip_analysis(boundary_border_dissolved, route_buffer, boundary_border_within_buffer_multipart)
+        arcpy.MultipartToSinglepart_management(boundary_border_within_buffer_multipart, boundary_border_within_buffer)
+        add_boundary_angles(boundary_border_within_buffer)
+
+    # get the angle to the true north(= 0 degree) of candidate route segments, in one bulk read
+    candidate_ids, x_first, y_first, x_last, y_last = read_segment_endpoints(candidate_border_route)
+    route_angles = calculate_angles(x_first, y_first, x_last, y_last)
+
+    # locate boundary segment within buffer along candidate border route.
+    # assuming that if the boundary segment can't be located along its corresponding route, these two might have high angles.
+    boundary_along_candidate_border_route = scratch.path("{0}_boundary_along_candidate_{1}_border_route".format(boundary,boundary))
+    arcpy.LocateFeaturesAlongRoutes_lr(boundary_border_within_buffer,candidate_border_route,"SEGMENT_ID_ALL_CANDIDATES",buffer_size,\
+                                       boundary_along_candidate_border_route,"{0} {1} {2} {3}".format("RID","LINE","FMEAS","TMEAS"))
+
+    # filter out negative candidate border route
+    located = arcpy.da.TableToNumPyArray(boundary_along_candidate_border_route, ["RID","ANGLE_BOUNDARY"], null_value=-1)
+    positive_candidate_border_route, negative_candidate_border_route = classify_candidate_border_routes(candidate_ids, route_angles,\
+                                                                                                         located["RID"], located["ANGLE_BOUNDARY"], high_angle_threshold)
+
+    # flag candidate border route segments and split them on the flag, instead of selecting them by long OBJECTID lists
+    # the flag of a previous, failed run is replaced
+    if arcpy.ListFields(candidate_border_route, "POSITIVE_CANDIDATE"):
+        arcpy.DeleteField_management(candidate_border_route, "POSITIVE_CANDIDATE")
+    candidate_flags = numpy.zeros(len(candidate_ids), dtype=[("SEGMENT_ID_ALL_CANDIDATES", numpy.int32), ("POSITIVE_CANDIDATE", numpy.int16)])
+    candidate_flags["SEGMENT_ID_ALL_CANDIDATES"] = candidate_ids
+    candidate_flags["POSITIVE_CANDIDATE"] = numpy.isin(candidate_ids, positive_candidate_border_route)
+    arcpy.da.ExtendTable(candidate_border_route, "SEGMENT_ID_ALL_CANDIDATES", candidate_flags, "SEGMENT_ID_ALL_CANDIDATES")
+
+    candidate_border_route_positive = output_scratch.path("candidate_{0}_border_route_positive".format(boundary))
+    arcpy.Select_analysis(candidate_border_route, candidate_border_route_positive, "\"{0}\" = 1".format("POSITIVE_CANDIDATE"))
+
+    return candidate_border_route_positive
+
+
+def select_diagnostic_features(scratch,features,name,where_clause):
+    """
+    Copy features matching where_clause into the workspace of kept intermediates, for inspection in debug mode.
+    """
+    diagnostic_features = scratch.keep_path(name)
+    arcpy.Select_analysis(features, diagnostic_features, where_clause)
+
+    return diagnostic_features
+
+
+def get_both_sides_where_clause(boundary_id_field):
+    # route segments with boundary on both sides
+    return "\"{0}\" IS NOT NULL AND \"{1}\" IS NOT NULL".format("LEFT_{0}".format(boundary_id_field),"RIGHT_{0}".format(boundary_id_field))
+
+
+def add_boundary_angles(boundary_segments):
+    # Add 'ANGLE_BOUNDARY' field to boundary segments and populate it with the angle to the true north(= 0 degree)
+    boundary_ids, x_first, y_first, x_last, y_last = read_segment_endpoints(boundary_segments)
+    boundary_angles = numpy.zeros(len(boundary_ids), dtype=[("SEGMENT_OID", numpy.int32), ("ANGLE_BOUNDARY", numpy.float64)])
+    boundary_angles["SEGMENT_OID"] = boundary_ids
+    boundary_angles["ANGLE_BOUNDARY"] = calculate_angles(x_first, y_first, x_last, y_last)
+    arcpy.da.ExtendTable(boundary_segments, arcpy.Describe(boundary_segments).OIDFieldName, boundary_angles, "SEGMENT_OID")
+
+
+def assign_boundary_sides(scratch,output_scratch,boundary,boundary_id_field,candidate_border_route_positive,boundary_border_offset,offset,spatial_reference):
+    xy_resolution = "{0} {1}".format(spatial_reference.XYResolution,spatial_reference.linearUnitName)
+
+    # get intersections between positive candidate border route and boundary offset
+    candidate_border_route_positive_boundary_offset_intersections = scratch.path("candidate_{0}_border_route_positive_{1}_offset_intersections".format(boundary,boundary))
+    arcpy.Intersect_analysis([candidate_border_route_positive,boundary_border_offset], candidate_border_route_positive_boundary_offset_intersections, "ALL", "", "point")
+
+    # split positive candidate border route by intersections generated above
+    candidate_border_route_positive_splitted_by_offset = output_scratch.path("candidate_{0}_border_route_positive_splitted_by_offset".format(boundary))
+    arcpy.SplitLineAtPoint_management(candidate_border_route_positive,candidate_border_route_positive_boundary_offset_intersections,\
+                                      candidate_border_route_positive_splitted_by_offset,xy_resolution)
+
+    # get positive candidate border route segments that within boundary offset
+    candidate_border_route_positive_splitted_by_offset_lyr = "in_memory\\candidate_{0}_border_route_positive_splitted_by_offset_lyr".format(boundary)
+    arcpy.MakeFeatureLayer_management(candidate_border_route_positive_splitted_by_offset, candidate_border_route_positive_splitted_by_offset_lyr)
+    arcpy.SelectLayerByLocation_management (candidate_border_route_positive_splitted_by_offset_lyr, "WITHIN", boundary_border_offset)
+    with arcpy.da.SearchCursor(candidate_border_route_positive_splitted_by_offset_lyr, ["OID@"]) as sCur:
+        within_offset_ids = [row[0] for row in sCur]
+
+    # sample points left and right of positive candidate border route segments, twice the offset away across the
+    # border for segments within boundary offset, on the segment for segments out of it, and locate them in boundary polygons
+    segment_ids, left_samples, right_samples = read_segment_side_samples(candidate_border_route_positive_splitted_by_offset,within_offset_ids,\
+                                                                         get_linear_distance(offset,spatial_reference))
+    sample_boundary_ids = locate_points_in_boundary(scratch,numpy.concatenate((left_samples,right_samples)),boundary,boundary_id_field,spatial_reference)
+    side_boundary_ids = dict(zip(segment_ids, zip(sample_boundary_ids[:len(segment_ids)], sample_boundary_ids[len(segment_ids):])))
+
+    # write left, right boundary id of positive candidate border route segments directly
+    boundary_id = arcpy.ListFields(boundary, boundary_id_field)[0]
+    for side in ("LEFT", "RIGHT"):
+        add_field_like(candidate_border_route_positive_splitted_by_offset,"{0}_{1}".format(side,boundary_id_field),boundary_id)
+    with arcpy.da.UpdateCursor(candidate_border_route_positive_splitted_by_offset,["OID@","LEFT_{0}".format(boundary_id_field),"RIGHT_{0}".format(boundary_id_field)]) as uCur:
+        for row in uCur:
+            left_id, right_id = side_boundary_ids.get(row[0], (None, None))
+            uCur.updateRow([row[0], left_id, right_id])
+
+    # segments without boundary on both sides are filtered out when read, see get_both_sides_where_clause
+    return candidate_border_route_positive_splitted_by_offset
+
+
+def populate_route_border_rule_table(scratch,workspace,route_id_field,boundary,boundary_id_field,route_segments,route_border_rule_table,process_date,clip_extent=None,compaction=None):
+    # keep segments within clip extent only, e.g. the tile
+    if clip_extent:
+        route_segments_clipped_multipart = scratch.path("candidate_{0}_border_route_positive_with_{1}_topology_clipped_multipart".format(boundary,boundary))
+        route_segments_clipped = scratch.path("candidate_{0}_border_route_positive_with_{1}_topology_clipped".format(boundary,boundary))
+        arcpy.Clip_analysis(route_segments, clip_extent, route_segments_clipped_multipart)
+        arcpy.MultipartToSinglepart_management(route_segments_clipped_multipart, route_segments_clipped)
+        route_segments = route_segments_clipped
+
+    # read rule table rows of segments with boundary on both sides, with from measure, to measure, segment geometry and
+    # process date in one pass, sort them
+    # based on route id and from measure, orderly, compact them, and populate route_border_rule_table with them
+    rows = read_route_border_rule_source_rows(route_segments,route_id_field,boundary_id_field,process_date,get_both_sides_where_clause(boundary_id_field))
+    rows = sort_route_border_rule_rows(rows)
+    if compaction:
+        rows = compact_route_border_rule_rows(rows,*compaction)
+    route_border_rule_table = os.path.join(workspace,route_border_rule_table)
+    write_route_border_rule_rows(route_border_rule_table,rows)
+
+    return route_border_rule_table
 
 
 def create_route_border_rule_table_schema(workspace,route_border_rule_table):
     # create table
     arcpy.CreateTable_management(workspace,route_border_rule_table)
+    route_border_rule_table = os.path.join(workspace,route_border_rule_table)
 
     # add fields
     field_length = 100
@@ -364,37 +947,1301 @@ def create_route_border_rule_table_schema(workspace,route_border_rule_table):
     arcpy.AddField_management(route_border_rule_table,"BRP_PROCESS_DT","DATE")
 
 
-def calculate_angle(x_first,y_first,x_last,y_last):
+def read_route_border_rule_rows(route_border_rule_table):
+    with arcpy.da.SearchCursor(route_border_rule_table,ROUTE_BORDER_RULE_TABLE_FIELDS) as sCur:
+        return [row for row in sCur]
+
+
+def write_route_border_rule_rows(route_border_rule_table,rows):
+    """
+    (Re)create the rule table and insert rows into it.
+    """
+    if arcpy.Exists(route_border_rule_table):
+        arcpy.Delete_management(route_border_rule_table)
+    create_route_border_rule_table_schema(os.path.dirname(route_border_rule_table),os.path.basename(route_border_rule_table))
+
+    with arcpy.da.InsertCursor(route_border_rule_table,ROUTE_BORDER_RULE_TABLE_FIELDS) as iCur:
+        for row in rows:
+            iCur.insertRow(row)
+
+
+def read_route_border_rule_source_rows(route_segments,route_id_field,boundary_id_field,process_date,where_clause=None):
+    """
+    Rule table rows of route segments with left, right boundary ids, measures being the M of their first and last vertex.
+    """
+    with arcpy.da.SearchCursor(route_segments,[route_id_field,"SHAPE@","LEFT_{0}".format(boundary_id_field),"RIGHT_{0}".format(boundary_id_field),
+                                               "START_DATE","END_DATE"],where_clause) as sCur:
+        for route_id, shape, left_id, right_id, start_date, end_date in sCur:
+            yield (route_id, shape.firstPoint.M, shape.lastPoint.M, left_id, right_id, shape.type, start_date, end_date, process_date)
+
+
+def sort_route_border_rule_rows(rows,max_rows_in_memory=SORT_MAX_ROWS_IN_MEMORY):
+    """
+    Sort rule table rows based on route id and from measure, in memory, or by an external merge sort of sorted chunks
+    spilled to temporary files once there are more than max_rows_in_memory.
+    @return: iterator of sorted rows
+    """
+    def key(row):
+        return (row[0] or "", row[1] if row[1] is not None else float("-inf"))
+
+    chunk = []
+    chunk_folder = None
+    chunk_files = []
+    try:
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= max_rows_in_memory:
+                chunk_folder = chunk_folder or tempfile.mkdtemp(prefix="border_route_sort_")
+                chunk_files.append(write_sorted_chunk(chunk_folder,len(chunk_files),chunk,key))
+                chunk = []
+
+        chunk.sort(key=key)
+        if not chunk_files:
+            for row in chunk:
+                yield row
+            return
+
+        chunk_files.append(write_sorted_chunk(chunk_folder,len(chunk_files),chunk,key))
+        chunk = []
+        # rows are never compared, merged entries are unique by chunk and position
+        for entry in heapq.merge(*[read_sorted_chunk(chunk_file,chunk_index,key) for chunk_index, chunk_file in enumerate(chunk_files)]):
+            yield entry[-1]
+    finally:
+        if chunk_folder:
+            shutil.rmtree(chunk_folder, ignore_errors=True)
+
+
+def write_sorted_chunk(folder,chunk_index,chunk,key):
+    chunk.sort(key=key)
+    chunk_file = os.path.join(folder,"chunk_{0}.pickle".format(chunk_index))
+    with open(chunk_file,"wb") as output_file:
+        for row in chunk:
+            pickle.dump(row,output_file,pickle.HIGHEST_PROTOCOL)
+
+    return chunk_file
+
+
+def read_sorted_chunk(chunk_file,chunk_index,key):
+    with open(chunk_file,"rb") as input_file:
+        position = 0
+        while True:
+            try:
+                row = pickle.load(input_file)
+            except EOFError:
+                return
+            yield key(row), chunk_index, position, row
+            position += 1
+
+
+def export_route_border_rule_rows(rows,path):
+    """
+    Write rule table rows to a CSV file, or to a Parquet file if path ends with .parquet (needs pyarrow), for consumers
+    not reading file geodatabases.
+    """
+    if path.lower().endswith(".parquet"):
+        export_route_border_rule_rows_to_parquet(rows,path)
+        return
+
+    with (open(path,"w",newline="") if sys.version_info[0] >= 3 else open(path,"wb")) as output_file:
+        writer = csv.writer(output_file)
+        writer.writerow(ROUTE_BORDER_RULE_TABLE_FIELDS)
+        for row in rows:
+            writer.writerow(["" if value is None else value.isoformat() if isinstance(value, datetime) else value for value in row])
+
+
+def export_route_border_rule_rows_to_parquet(rows,path,batch_size=100000):
+    types = [pyarrow.string(), pyarrow.float64(), pyarrow.float64(), pyarrow.string(), pyarrow.string(), pyarrow.string(),
+             pyarrow.timestamp("us"), pyarrow.timestamp("us"), pyarrow.timestamp("us")]
+    schema = pyarrow.schema(list(zip(ROUTE_BORDER_RULE_TABLE_FIELDS, types)))
+
+    def write_batch(batch):
+        columns = [list(column) for column in zip(*batch)]
+        for index, field_type in enumerate(types):
+            if field_type == pyarrow.string():
+                columns[index] = [None if value is None else str(value) for value in columns[index]]
+            else:
+                # dates of the shapely backend are ISO strings as read from GeoJSON properties
+                columns[index] = [parse_date(value) if field_type == pyarrow.timestamp("us") else value for value in columns[index]]
+        writer.write_table(pyarrow.Table.from_arrays([pyarrow.array(column, field_type) for column, field_type in zip(columns, types)], schema=schema))
+
+    writer = pyarrow.parquet.ParquetWriter(path, schema)
     try:
-        delta_x = x_last - x_first
-        delta_y = y_last - y_first
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= batch_size:
+                write_batch(batch)
+                batch = []
+        if batch:
+            write_batch(batch)
+    finally:
+        writer.close()
+
+
+def parse_date(value):
+    """
+    Date of an ISO date string such as "2015-01-01" or "2015-01-01T00:00:00", dates and None returned as they are.
+    """
+    if value is None or isinstance(value, datetime):
+        return value
 
-        angle = -1
+    value = str(value)
+    return datetime.strptime(value[:19], "%Y-%m-%dT%H:%M:%S") if "T" in value else datetime.strptime(value[:10], "%Y-%m-%d")
 
-        if delta_x == 0 and delta_y > 0:
-            angle = 0
-        elif delta_x > 0:
-            angle = 90 - math.degrees(math.atan(delta_y/delta_x))
-        elif delta_x == 0 and delta_y < 0:
-            angle = 180
-        elif delta_x < 0:
-            angle = 270 - math.degrees(math.atan(delta_y/delta_x))
 
-        return angle
-    except Exception:
-        # arcpy.AddMessage(traceback.format_exc())
-        sys.exit(traceback.format_exc())
+def stitch_route_border_rule_rows(tile_rows,tolerance):
+    """
+    Merge rule table rows of the same route and boundaries cut at tile seams.
+    Rows of different tiles touch at tile seams only, so touching rows are merged only if they come from different
+    tiles, and rows are otherwise kept as a single pass produces them.
+    @param tile_rows: [(rule table row, tile index)]
+    @param tolerance: max gap between measures of touching rows
+    @return: rule table rows, sorted by route id and start measure
+    """
+    # rows on a seam are found in both tiles, keep them from one tile only
+    precision = max(tolerance, 1e-9)
+    row_tiles = {}
+    unique_tile_rows = []
+    for row, tile_index in tile_rows:
+        key = (row[0],) + tuple(None if measure is None else int(round(measure / precision)) for measure in row[1:3]) + tuple(row[3:8])
+        if row_tiles.setdefault(key, tile_index) == tile_index:
+            unique_tile_rows.append((row, tile_index))
+
+    # rows are compared on their span of measures, measures decrease along routes measured against their direction
+    def get_span(row):
+        return (min(row[1], row[2]), max(row[1], row[2])) if row[1] is not None and row[2] is not None else None
+
+    unique_tile_rows.sort(key=lambda tile_row: (tile_row[0][0] or "",) + (get_span(tile_row[0]) or (float("-inf"), float("-inf"))))
+
+    rows = []
+    last_tile_index = None
+    for row, tile_index in unique_tile_rows:
+        if rows:
+            last_row = rows[-1]
+            last_span = get_span(last_row)
+            span = get_span(row)
+            if last_span and span and last_row[0] == row[0] and last_row[3:8] == row[3:8] and tile_index != last_tile_index and \
+                    abs(last_span[1] - span[0]) <= tolerance:
+                start, end = last_span[0], max(last_span[1], span[1])
+                rows[-1] = (last_row[0],) + ((start, end) if last_row[1] <= last_row[2] else (end, start)) + tuple(last_row[3:])
+                last_tile_index = tile_index
+                continue
+
+        rows.append(tuple(row))
+        last_tile_index = tile_index
+
+    return rows
+
+
+def compact_route_border_rule_rows(rows,tolerance=0,min_length=0):
+    """
+    Merge rows of the same route and the same boundaries and dates whose measures overlap or touch within tolerance,
+    and drop rows shorter than min_length, leaving the minimal set of spans per route. Rows are merged across a gap
+    only if no other row of the route lies in it.
+    @param rows: rule table rows, grouped by route id, e.g. sorted by route id and start measure
+    @return: iterator of rule table rows, sorted by route id and start measure
+    """
+    for route_id, route_rows in itertools.groupby(rows, key=lambda row: row[0]):
+        spans = sorted(((min(row[1], row[2]), max(row[1], row[2]), row) for row in route_rows if row[1] is not None and row[2] is not None),
+                       key=lambda span: (tuple("" if value is None else str(value) for value in span[2][3:8]), span[0], span[1]))
+
+        # spans of the route by start, with the running maximum of their ends, for the gap test
+        starts = []
+        max_ends = []
+        for start, end, row in sorted(spans, key=lambda span: span[0]):
+            starts.append(start)
+            max_ends.append(max(max_ends[-1], end) if max_ends else end)
+
+        compacted = []
+        for start, end, row in spans:
+            if compacted:
+                last_start, last_end, last_row = compacted[-1]
+                # spans starting before the gap ends, other than the ones merged, all end before it starts
+                if last_row[3:8] == row[3:8] and start <= last_end + tolerance and \
+                        (start <= last_end or max_ends[bisect.bisect_left(starts, start) - 1] <= last_end):
+                    compacted[-1] = (last_start, max(last_end, end), last_row)
+                    continue
+            compacted.append((start, end, row))
+
+        for start, end, row in sorted(compacted, key=lambda span: (span[0], span[1])):
+            if end - start >= min_length:
+                yield (row[0], start, end) + tuple(row[3:])
+
+
+def compare_route_border_rule_rows(rows,reference_rows,tolerance=0):
+    """
+    Differences of rule table rows from reference rows, e.g. of a run on generalized boundaries from the full-precision
+    run: spans of measures where a route has the same left and right boundaries in one of them but not in the other,
+    longer than tolerance.
+    @return: [(route id, left id, right id, start measure, end measure)], sorted
+    """
+    spans = {}
+    for index, table_rows in enumerate((rows, reference_rows)):
+        for row in table_rows:
+            if row[1] is not None and row[2] is not None:
+                spans.setdefault((row[0], row[3], row[4]), ([], []))[index].append((min(row[1], row[2]), max(row[1], row[2])))
+
+    differences = []
+    for (route_id, left_id, right_id), (table_spans, reference_spans) in spans.items():
+        measures = sorted(set(measure for span in table_spans + reference_spans for measure in span))
+
+        # pieces between consecutive span ends covered by one of the tables only, merged where they touch
+        start = end = None
+        for piece_start, piece_end in zip(measures[:-1], measures[1:]):
+            middle = (piece_start + piece_end) / 2.0
+            in_table = any(span_start <= middle <= span_end for span_start, span_end in table_spans)
+            in_reference = any(span_start <= middle <= span_end for span_start, span_end in reference_spans)
+            if in_table != in_reference:
+                if start is None or piece_start != end:
+                    if start is not None and end - start > tolerance:
+                        differences.append((route_id, left_id, right_id, start, end))
+                    start = piece_start
+                end = piece_end
+        if start is not None and end - start > tolerance:
+            differences.append((route_id, left_id, right_id, start, end))
+
+    return sorted(differences, key=lambda difference: tuple("" if value is None else str(value) for value in difference[:3]) + difference[3:])
+
+
+def generalize_boundaries(workspace,jobs,tolerance_fraction,offset):
+    """
+    Generalized copies of boundaries, named <boundary>_GENERALIZED, with edges shared by polygons of any of them
+    simplified once, the same way, so neighbor polygons neither gap nor overlap. The copies are written into the
+    workspace, so the pipeline finds them by name like the boundaries, and removed by run() when it is done unless
+    kept by KEEP_INTERMEDIATES.
+    @param tolerance_fraction: simplification tolerance as a fraction of offset
+    @return: jobs on the generalized boundaries
+    """
+    spatial_reference = arcpy.Describe(jobs[0][0]).spatialReference
+    tolerance = tolerance_fraction * get_linear_distance(offset,spatial_reference)
+
+    generalized_jobs = []
+    for boundary, boundary_id_field, route_border_rule_table in jobs:
+        generalized_boundary = "{0}_GENERALIZED".format(boundary)
+        arcpy.CopyFeatures_management(boundary, os.path.join(workspace,generalized_boundary))
+        generalized_jobs.append((generalized_boundary, boundary_id_field, route_border_rule_table))
+    generalized_boundaries = [os.path.join(workspace,generalized_boundary) for generalized_boundary, boundary_id_field, route_border_rule_table in generalized_jobs]
+
+    vertex_counts = [get_vertex_count(generalized_boundary) for generalized_boundary in generalized_boundaries]
+
+    # all boundaries are simplified together, so edges shared across them are simplified consistently
+    arcpy.SimplifySharedEdges_cartography(generalized_boundaries, "POINT_REMOVE", tolerance)
+
+    for (boundary, boundary_id_field, route_border_rule_table), generalized_boundary, vertex_count in zip(jobs, generalized_boundaries, vertex_counts):
+        generalized_vertex_count = get_vertex_count(generalized_boundary)
+        logger.info("Generalized {0} with tolerance {1}: {2} vertices, {3} before, {4:.1f}% fewer".format(
+            boundary, tolerance, generalized_vertex_count, vertex_count, 100.0 * (vertex_count - generalized_vertex_count) / max(vertex_count, 1)))
+
+    return generalized_jobs
+
+
+def validate_generalization(workspace,route,route_id_field,jobs,buffer_size,high_angle_threshold,offset,measure_tolerance,cache=None,scratch=None,compaction=None):
+    """
+    Compare rule tables generated on generalized boundaries with the ones of a full-precision run, generated into
+    <rule table>_FULL_PRECISION, and log differences longer than measure_tolerance. Full-precision tables are compacted
+    the same way as the rule tables, and removed unless kept by KEEP_INTERMEDIATES.
+    @param jobs: jobs on the full-precision boundaries
+    @param compaction: (tolerance, min length) the rule tables were compacted with, None if they are not compacted
+    @return: number of differences
+    """
+    route_buffer = get_route_buffer(scratch,route,buffer_size,cache)
+    difference_count = 0
+    for boundary, boundary_id_field, route_border_rule_table in jobs:
+        reference_table = generate_route_border_rule_table(workspace,route,route_id_field,boundary,boundary_id_field,buffer_size,
+                                                           "{0}_FULL_PRECISION".format(route_border_rule_table),high_angle_threshold,offset,route_buffer,cache,scratch,
+                                                           compaction=compaction)
+        if not reference_table:
+            sys.exit("Failed when generating full-precision border route rule source table for {0} feature. Exit".format(boundary))
+
+        differences = compare_route_border_rule_rows(read_route_border_rule_rows(os.path.join(workspace,route_border_rule_table)),
+                                                     read_route_border_rule_rows(reference_table),measure_tolerance)
+        difference_count += len(differences)
+        if differences:
+            logger.warning("{0} differs from the full-precision run in {1} spans longer than {2}, e.g. {3}".format(
+                route_border_rule_table, len(differences), measure_tolerance, differences[:5]))
+        else:
+            logger.info("{0} is within {1} of the full-precision run".format(route_border_rule_table, measure_tolerance))
+
+        if not (scratch and scratch.kept(os.path.basename(reference_table))):
+            arcpy.Delete_management(reference_table)
+
+    return difference_count
+
+
+def get_vertex_count(features):
+    with arcpy.da.SearchCursor(features, ["SHAPE@"]) as sCur:
+        return sum(row[0].pointCount for row in sCur if row[0])
+
+
+def get_tiles(extent,tile_size):
+    """
+    Grid of tiles covering extent.
+    @return: [(xmin, ymin, xmax, ymax)]
+    """
+    columns = max(1, int(math.ceil((extent.XMax - extent.XMin) / tile_size)))
+    rows = max(1, int(math.ceil((extent.YMax - extent.YMin) / tile_size)))
+
+    return [(extent.XMin + column * tile_size, extent.YMin + row * tile_size,
+             extent.XMin + (column + 1) * tile_size, extent.YMin + (row + 1) * tile_size)
+            for row in range(rows) for column in range(columns)]
+
+
+def get_extent_polygon(xmin,ymin,xmax,ymax,spatial_reference):
+    return arcpy.Polygon(arcpy.Array([arcpy.Point(xmin,ymin),arcpy.Point(xmin,ymax),arcpy.Point(xmax,ymax),
+                                      arcpy.Point(xmax,ymin),arcpy.Point(xmin,ymin)]),spatial_reference)
+
+
+def get_linear_distance(distance,spatial_reference):
+    """
+    Linear distance such as "25 Feet" in units of the spatial reference.
+    """
+    return convert_linear_distance(distance,spatial_reference.metersPerUnit)
+
+
+def convert_linear_distance(distance,meters_per_unit):
+    """
+    Linear distance such as "25 Feet" in a unit of meters_per_unit meters. Distances without unit are returned as is.
+    """
+    parts = str(distance).split()
+    value = float(parts[0])
+    if len(parts) < 2 or not meters_per_unit:
+        return value
+
+    return value * LINEAR_UNITS_IN_METERS[parts[1].lower()] / meters_per_unit
+
+
+def create_process_pool(workers, initializer=None, initargs=()):
+    if sys.platform == "win32":
+        # arcpy hosts (ArcMap, ArcGIS Pro) are not able to spawn themselves as workers
+        multiprocessing.set_executable(os.path.join(sys.exec_prefix, "python.exe"))
+
+    if not initializer:
+        initializer, initargs = initialize_worker, (run_report.enabled, run_report.count_vertices)
+
+    return multiprocessing.Pool(workers, initializer, initargs)
+
+
+def initialize_worker(instrument=False, count_vertices=False):
+    setup_logger()
+    # drop records inherited from a forked parent
+    run_report.pop_records()
+    run_report.configure(instrument, count_vertices)
+
+
+def upsert_route_border_rule_rows(route_border_rule_table,route_border_rule_table_delta,route_ids):
+    """
+    Replace rows of routes in the rule table by the rows of the same routes in the delta rule table.
+    @param route_border_rule_table_delta: rule table of the routes, None if they have no rows any more
+    """
+    with arcpy.da.UpdateCursor(route_border_rule_table,["ROUTE_ID"]) as uCur:
+        for row in uCur:
+            if row[0] in route_ids:
+                uCur.deleteRow()
+
+    if route_border_rule_table_delta:
+        with arcpy.da.SearchCursor(route_border_rule_table_delta,ROUTE_BORDER_RULE_TABLE_FIELDS) as sCur:
+            with arcpy.da.InsertCursor(route_border_rule_table,ROUTE_BORDER_RULE_TABLE_FIELDS) as iCur:
+                for row in sCur:
+                    iCur.insertRow(row)
+
+
+def copy_features_by_ids(features,id_field,ids,output):
+    """
+    Copy features whose id is in ids, without a where clause that grows with the number of ids.
+    """
+    description = arcpy.Describe(features)
+    arcpy.CreateFeatureclass_management(os.path.dirname(output),os.path.basename(output),description.shapeType,features,
+                                        "SAME_AS_TEMPLATE","SAME_AS_TEMPLATE",description.spatialReference)
+
+    fields = ["SHAPE@"] + [field.name for field in description.fields if field.editable and field.type not in ("OID","Geometry")]
+    id_index = fields.index(id_field)
+    with arcpy.da.SearchCursor(features,fields) as sCur:
+        with arcpy.da.InsertCursor(output,fields) as iCur:
+            for row in sCur:
+                if row[id_index] in ids:
+                    iCur.insertRow(row)
+
+
+def get_route_fingerprints(route,route_id_field):
+    """
+    Fingerprint of every route: a checksum over geometries (with measures) and effective dates of all its features.
+    @return: {route id: fingerprint}
+    """
+    row_checksums = {}
+    with arcpy.da.SearchCursor(route,[route_id_field,"SHAPE@WKB","START_DATE","END_DATE"]) as sCur:
+        for row in sCur:
+            checksum = hashlib.sha1(bytes(row[1] or b""))
+            checksum.update("{0}|{1}".format(row[2],row[3]).encode("utf8"))
+            row_checksums.setdefault(row[0],[]).append(checksum.hexdigest())
+
+    # independent of feature order
+    return dict((route_id, hashlib.sha1("".join(sorted(checksums)).encode("utf8")).hexdigest())
+                for route_id, checksums in row_checksums.items())
+
+
+def get_changed_route_ids(route_state_table,route_fingerprints):
+    """
+    Routes added, edited or deleted since the route state was written.
+    """
+    previous_fingerprints = {}
+    with arcpy.da.SearchCursor(route_state_table,["ROUTE_ID","ROUTE_FINGERPRINT"]) as sCur:
+        for row in sCur:
+            previous_fingerprints[row[0]] = row[1]
+
+    changed_route_ids = set(route_id for route_id, fingerprint in route_fingerprints.items() if previous_fingerprints.get(route_id) != fingerprint)
+    changed_route_ids.update(set(previous_fingerprints) - set(route_fingerprints))
+
+    return changed_route_ids
+
+
+def get_boundary_fingerprints(jobs,parameters):
+    """
+    Fingerprint of every boundary with its id field, and of the run parameters rows are generated with, under
+    RUN_PARAMETERS_STATE.
+    @param parameters: values of the run parameters, e.g. buffer size, offset and compaction tolerance
+    @return: {boundary: fingerprint}
+    """
+    boundary_fingerprints = dict((boundary, hashlib.sha1(json.dumps([PreprocessCache.fingerprint_dataset(boundary), boundary_id_field], sort_keys=True).encode("utf8")).hexdigest())
+                                 for boundary, boundary_id_field, route_border_rule_table in jobs)
+    boundary_fingerprints[RUN_PARAMETERS_STATE] = hashlib.sha1(json.dumps(parameters).encode("utf8")).hexdigest()
+
+    return boundary_fingerprints
+
+
+def get_changed_boundaries(route_state_table,boundary_fingerprints):
+    """
+    Boundaries edited, added or with another id field since the route state was written, and RUN_PARAMETERS_STATE if
+    run parameters changed, all of them if it has no boundary state.
+    """
+    boundary_state_table = "{0}_BOUNDARIES".format(route_state_table)
+    if not arcpy.Exists(boundary_state_table):
+        return sorted(boundary_fingerprints)
+
+    with arcpy.da.SearchCursor(boundary_state_table,["BOUNDARY","BOUNDARY_FINGERPRINT"]) as sCur:
+        previous_fingerprints = dict((row[0], row[1]) for row in sCur)
+
+    return sorted(boundary for boundary, fingerprint in boundary_fingerprints.items() if previous_fingerprints.get(boundary) != fingerprint)
+
+
+def write_route_state(route_state_table,route_fingerprints,boundary_fingerprints):
+    """
+    Record route fingerprints and process date, and boundary fingerprints in <route state table>_BOUNDARIES, for the
+    next incremental run.
+    """
+    if arcpy.Exists(route_state_table):
+        arcpy.TruncateTable_management(route_state_table)
+    else:
+        arcpy.CreateTable_management(os.path.dirname(route_state_table),os.path.basename(route_state_table))
+        arcpy.AddField_management(route_state_table,"ROUTE_ID","TEXT","","",100)
+        arcpy.AddField_management(route_state_table,"ROUTE_FINGERPRINT","TEXT","","",40)
+        arcpy.AddField_management(route_state_table,"BRP_PROCESS_DT","DATE")
+
+    date = datetime.now()
+    with arcpy.da.InsertCursor(route_state_table,["ROUTE_ID","ROUTE_FINGERPRINT","BRP_PROCESS_DT"]) as iCur:
+        for route_id, fingerprint in route_fingerprints.items():
+            iCur.insertRow((route_id,fingerprint,date))
+
+    boundary_state_table = "{0}_BOUNDARIES".format(route_state_table)
+    if arcpy.Exists(boundary_state_table):
+        arcpy.TruncateTable_management(boundary_state_table)
+    else:
+        arcpy.CreateTable_management(os.path.dirname(boundary_state_table),os.path.basename(boundary_state_table))
+        arcpy.AddField_management(boundary_state_table,"BOUNDARY","TEXT","","",100)
+        arcpy.AddField_management(boundary_state_table,"BOUNDARY_FINGERPRINT","TEXT","","",40)
+        arcpy.AddField_management(boundary_state_table,"BRP_PROCESS_DT","DATE")
+
+    with arcpy.da.InsertCursor(boundary_state_table,["BOUNDARY","BOUNDARY_FINGERPRINT","BRP_PROCESS_DT"]) as iCur:
+        for boundary, fingerprint in boundary_fingerprints.items():
+            iCur.insertRow((boundary,fingerprint,date))
+
+
+def read_segment_endpoints(line_features):
+    """
+    Read the first and last vertex of every line feature into NumPy arrays in one bulk read.
+    @return: (oids, x_first, y_first, x_last, y_last)
+    """
+    vertices = arcpy.da.FeatureClassToNumPyArray(line_features, ["OID@", "SHAPE@XY"], explode_to_points=True)
+    if len(vertices) == 0:
+        empty = numpy.zeros(0)
+        return numpy.zeros(0, dtype=numpy.int32), empty, empty, empty, empty
+
+    oids = vertices["OID@"]
+    xy = vertices["SHAPE@XY"]
+
+    # exploded vertices are grouped by feature, in vertex order
+    feature_starts = numpy.flatnonzero(numpy.diff(oids)) + 1
+    first = numpy.concatenate(([0], feature_starts))
+    last = numpy.concatenate((feature_starts - 1, [len(oids) - 1]))
+
+    return oids[first], xy[first, 0], xy[first, 1], xy[last, 0], xy[last, 1]
+
+
+def calculate_angles(x_first, y_first, x_last, y_last):
+    """
+    Calculate the angle to the true north(= 0 degree) of segments from their endpoints.
+    Degenerated segments get -1.
+    """
+    delta_x = numpy.asarray(x_last, dtype=numpy.float64) - numpy.asarray(x_first, dtype=numpy.float64)
+    delta_y = numpy.asarray(y_last, dtype=numpy.float64) - numpy.asarray(y_first, dtype=numpy.float64)
+
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        slope = numpy.degrees(numpy.arctan(delta_y / delta_x))
+
+    angles = numpy.full(delta_x.shape, -1.0)
+    angles = numpy.where((delta_x == 0) & (delta_y > 0), 0.0, angles)
+    angles = numpy.where(delta_x > 0, 90 - slope, angles)
+    angles = numpy.where((delta_x == 0) & (delta_y < 0), 180.0, angles)
+    angles = numpy.where(delta_x < 0, 270 - slope, angles)
+
+    return angles
+
+
+def calculate_intersection_angles(angles_route, angles_boundary):
+    """
+    Fold the difference between two angles to the true north into the real intersecting angle (0 - 90 degree).
+    """
+    delta_angles = numpy.abs(numpy.asarray(angles_route) - numpy.asarray(angles_boundary))
+
+    return numpy.where((delta_angles > 90) & (delta_angles <= 270), numpy.abs(180 - delta_angles),
+                       numpy.where(delta_angles > 270, 360 - delta_angles, delta_angles))
+
+
+def classify_candidate_border_routes(candidate_ids, angles_route, located_ids, angles_boundary, high_angle_threshold):
+    """
+    Split candidate border route segments into positive ones, which run along at least one located boundary segment
+    within the high angle threshold, and negative ones.
+    @param candidate_ids: ids of all candidate border route segments
+    @param angles_route: angles of candidate border route segments, aligned with candidate_ids
+    @param located_ids: candidate border route segment id of every located boundary segment
+    @param angles_boundary: angles of located boundary segments, aligned with located_ids
+    @return: (positive ids, negative ids) as sorted NumPy arrays
+    """
+    candidate_ids = numpy.asarray(candidate_ids)
+    located_ids = numpy.asarray(located_ids)
+    angles_boundary = numpy.asarray(angles_boundary, dtype=numpy.float64)
+    if len(candidate_ids) == 0 or len(located_ids) == 0:
+        return numpy.zeros(0, dtype=candidate_ids.dtype), numpy.unique(candidate_ids)
+
+    # look up route angle of every located boundary segment
+    order = numpy.argsort(candidate_ids)
+    sorted_ids = candidate_ids[order]
+    sorted_angles = numpy.asarray(angles_route, dtype=numpy.float64)[order]
+    position = numpy.clip(numpy.searchsorted(sorted_ids, located_ids), 0, len(sorted_ids) - 1)
+    found = sorted_ids[position] == located_ids
+    located_angles_route = numpy.where(found, sorted_angles[position], -1)
+
+    valid = found & (located_angles_route >= 0) & (angles_boundary >= 0)
+    delta_angles = calculate_intersection_angles(located_angles_route, angles_boundary)
+
+    positive_ids = numpy.unique(located_ids[valid & (delta_angles <= high_angle_threshold)])
+    negative_ids = numpy.setdiff1d(candidate_ids, positive_ids)
+
+    return positive_ids, negative_ids
+
+
+def read_segment_side_samples(line_features, within_offset_ids, offset):
+    """
+    Sample points left and right of the middle of every line feature, in one bulk read.
+    Lines in within_offset_ids are sampled twice the offset away, the others on the line itself.
+    @return: (oids, left samples xy, right samples xy)
+    """
+    vertices = arcpy.da.FeatureClassToNumPyArray(line_features, ["OID@", "SHAPE@XY"], explode_to_points=True)
+    if len(vertices) == 0:
+        return numpy.zeros(0, dtype=numpy.int32), numpy.zeros((0, 2)), numpy.zeros((0, 2))
+
+    oids = vertices["OID@"]
+    xy = vertices["SHAPE@XY"]
+
+    feature_starts = numpy.flatnonzero(numpy.diff(oids)) + 1
+    first = numpy.concatenate(([0], feature_starts))
+    last = numpy.concatenate((feature_starts - 1, [len(oids) - 1]))
+
+    # distance of vertices along their line, increasing over all lines, so one sorted search finds positions on any line
+    steps = numpy.hypot(numpy.diff(xy[:, 0]), numpy.diff(xy[:, 1]))
+    steps[feature_starts - 1] = 0
+    distances = numpy.concatenate(([0], numpy.cumsum(steps)))
+    lengths = distances[last] - distances[first]
+
+    middle_distances = lengths / 2.0
+    delta = numpy.minimum(lengths / 4.0, offset)
+    middle = interpolate_along_lines(xy, distances, first, last, middle_distances)
+    ahead = interpolate_along_lines(xy, distances, first, last, middle_distances + delta)
+    behind = interpolate_along_lines(xy, distances, first, last, middle_distances - delta)
+
+    sample_distances = numpy.where(numpy.isin(oids[first], within_offset_ids), 2.0 * offset, 0.0)
+    left_samples, right_samples = calculate_side_samples(middle, ahead, behind, sample_distances)
+
+    return oids[first], left_samples, right_samples
+
+
+def interpolate_along_lines(xy, distances, first, last, line_distances):
+    """
+    Points at line_distances along lines, lines being vertex ranges first to last of xy, distances the increasing
+    distance of vertices, see read_segment_side_samples.
+    """
+    positions = distances[first] + numpy.clip(line_distances, 0, distances[last] - distances[first])
+    start = numpy.searchsorted(distances, positions, side="right") - 1
+    start = numpy.maximum(numpy.minimum(start, last - 1), first)
+    end = numpy.minimum(start + 1, last)
+
+    step = distances[end] - distances[start]
+    ratio = numpy.where(step > 0, (positions - distances[start]) / numpy.where(step > 0, step, 1), 0)
+
+    return xy[start] + (xy[end] - xy[start]) * ratio[:, None]
+
+
+def calculate_side_samples(middle, ahead, behind, sample_distances):
+    """
+    Points sample_distances away to the left and to the right of middle points, square to the direction from behind
+    to ahead. Shared by the arcpy and shapely backends.
+    @return: (left samples xy, right samples xy)
+    """
+    direction = ahead - behind
+    length = numpy.hypot(direction[:, 0], direction[:, 1])
+    length[length == 0] = 1
+    normal = numpy.column_stack((-direction[:, 1], direction[:, 0])) / length[:, None]
+    sample_distances = numpy.asarray(sample_distances, dtype=float)[:, None]
+
+    return middle + normal * sample_distances, middle - normal * sample_distances
+
+
+def locate_points_in_boundary(scratch, points, boundary, boundary_id_field, spatial_reference):
+    """
+    Boundary id of the polygon containing every point, in one spatial join of all points.
+    @return: boundary ids, None where no polygon contains the point
+    """
+    ids = [None] * len(points)
+    if len(points) == 0:
+        return ids
+
+    samples = scratch.path("{0}_side_samples".format(boundary))
+    arcpy.CreateFeatureclass_management(os.path.dirname(samples), os.path.basename(samples), "POINT", spatial_reference=spatial_reference)
+    arcpy.AddField_management(samples, "SAMPLE_ID", "LONG")
+    with arcpy.da.InsertCursor(samples, ["SAMPLE_ID", "SHAPE@XY"]) as iCur:
+        for sample_id, point in enumerate(points):
+            iCur.insertRow([sample_id, (float(point[0]), float(point[1]))])
+
+    samples_in_boundary = scratch.path("{0}_side_samples_in_boundary".format(boundary))
+    arcpy.SpatialJoin_analysis(samples, boundary, samples_in_boundary, "JOIN_ONE_TO_ONE", "KEEP_COMMON", "", "WITHIN")
+    with arcpy.da.SearchCursor(samples_in_boundary, ["SAMPLE_ID", boundary_id_field]) as sCur:
+        for sample_id, boundary_id in sCur:
+            ids[sample_id] = boundary_id
+
+    return ids
+
+
+def add_field_like(table, name, field):
+    """
+    Add a field of the type and length of an existing field, as listed by arcpy.ListFields.
+    """
+    field_types = {"String": "TEXT", "Integer": "LONG", "SmallInteger": "SHORT", "Double": "DOUBLE", "Single": "FLOAT",
+                   "Date": "DATE", "GUID": "GUID"}
+    arcpy.AddField_management(table, name, field_types.get(field.type, "TEXT"), "", "", field.length)
 
 
 def get_parameters():
     current_directory = os.path.dirname(os.path.realpath(__file__))
-    import ConfigParser
-    config = ConfigParser.ConfigParser()
+    try:
+        from ConfigParser import ConfigParser
+    except ImportError:
+        from configparser import ConfigParser
+    config = ConfigParser()
     config.read(os.path.join(current_directory, "configuration.ini"))
 
     return config
 
 
+def get_parameter(config, section, option, default=None):
+    """
+    Get optional parameter, falling back to default if it is missing or empty.
+    """
+    if config.has_option(section, option) and config.get(section, option).strip():
+        return config.get(section, option).strip()
+
+    return default
+
+
+class PreprocessCache(object):
+    """
+    Content-addressed cache of preprocessing outputs.
+    Every entry is a folder named by the fingerprint of its inputs and parameters, holding a file geodatabase with the
+    outputs and a manifest. Entries are evicted, least recently used first, above max_entries or max_size_mb.
+    """
+
+    manifest_name = "manifest.json"
+
+    def __init__(self, folder, max_entries=24, max_size_mb=4096, refresh=False):
+        self.folder = folder
+        self.max_entries = max_entries
+        self.max_size_mb = max_size_mb
+        self.refresh = refresh
+
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+
+    def get_or_create(self, step, inputs, parameters, build):
+        """
+        Get outputs of step from cache, or build them into a new entry.
+        @param inputs: input datasets, fingerprinted by content
+        @param parameters: parameters of step, e.g. buffer distances
+        @param build: function that takes a workspace and returns the output datasets created in it
+        @return: output datasets
+        """
+        fingerprint = {"step": step,
+                       "inputs": [self.fingerprint_dataset(dataset) for dataset in inputs],
+                       "parameters": [str(parameter) for parameter in parameters]}
+        key = hashlib.sha1(json.dumps(fingerprint, sort_keys=True).encode("utf8")).hexdigest()
+        entry_folder = os.path.join(self.folder, key)
+        manifest_path = os.path.join(entry_folder, self.manifest_name)
+
+        if not self.refresh and os.path.exists(manifest_path):
+            with open(manifest_path) as manifest_file:
+                manifest = json.load(manifest_file)
+            outputs = [os.path.join(entry_folder, "cache.gdb", output) for output in manifest["outputs"]]
+            if all(arcpy.Exists(output) for output in outputs):
+                logger.info("Reusing cached {0} ({1})".format(step, key))
+                manifest["last_used"] = time.time()
+                self.write_manifest(manifest_path, manifest)
+                return outputs
+
+        # (re)build entry
+        logger.info("Building {0} ({1})".format(step, key))
+        if os.path.exists(entry_folder):
+            shutil.rmtree(entry_folder)
+        os.makedirs(entry_folder)
+        cache_workspace = arcpy.CreateFileGDB_management(entry_folder, "cache.gdb").getOutput(0)
+        outputs = list(build(cache_workspace))
+
+        self.write_manifest(manifest_path, {"key": key,
+                                            "step": step,
+                                            "fingerprint": fingerprint,
+                                            "outputs": [os.path.basename(output) for output in outputs],
+                                            "created": time.time(),
+                                            "last_used": time.time()})
+        return outputs
+
+    def evict(self):
+        """
+        Remove least recently used entries above max_entries or max_size_mb.
+        """
+        entries = []
+        for key in os.listdir(self.folder):
+            entry_folder = os.path.join(self.folder, key)
+            manifest_path = os.path.join(entry_folder, self.manifest_name)
+            if not os.path.exists(manifest_path):
+                continue
+            with open(manifest_path) as manifest_file:
+                last_used = json.load(manifest_file).get("last_used", 0)
+            entries.append((last_used, entry_folder, get_folder_size(entry_folder)))
+
+        entries.sort()
+        total_size = sum(entry[2] for entry in entries)
+        while entries and (len(entries) > self.max_entries or total_size > self.max_size_mb * 1024 * 1024):
+            last_used, entry_folder, size = entries.pop(0)
+            logger.info("Evicting cache entry {0}".format(os.path.basename(entry_folder)))
+            shutil.rmtree(entry_folder, ignore_errors=True)
+            total_size -= size
+
+    @staticmethod
+    def write_manifest(manifest_path, manifest):
+        with open(manifest_path, "w") as manifest_file:
+            json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+
+    @staticmethod
+    def fingerprint_dataset(dataset):
+        """
+        Fingerprint of a feature class: feature count, extent, spatial reference, and the last edit date if editor
+        tracking is enabled, otherwise a checksum of geometries and attributes, e.g. boundary ids outputs are grouped by.
+        """
+        description = arcpy.Describe(dataset)
+        extent = description.extent
+        spatial_reference = description.spatialReference
+        fingerprint = {"name": description.baseName,
+                       "count": int(arcpy.GetCount_management(dataset).getOutput(0)),
+                       "extent": [extent.XMin, extent.YMin, extent.XMax, extent.YMax, extent.MMin, extent.MMax],
+                       "spatial_reference": [spatial_reference.factoryCode, spatial_reference.name]}
+
+        if getattr(description, "editorTrackingEnabled", False) and description.editedAtFieldName:
+            with arcpy.da.SearchCursor(dataset, [description.editedAtFieldName]) as sCur:
+                fingerprint["last_edited"] = str(max([row[0] for row in sCur if row[0]] or [None]))
+        else:
+            attribute_fields = [field.name for field in arcpy.ListFields(dataset) if field.type not in ("OID", "Geometry", "Blob", "Raster")]
+            checksum = hashlib.sha1()
+            with arcpy.da.SearchCursor(dataset, ["OID@", "SHAPE@WKB"] + attribute_fields) as sCur:
+                for row in sCur:
+                    checksum.update(str(row[0]).encode("utf8"))
+                    checksum.update(bytes(row[1] or b""))
+                    checksum.update(json.dumps([str(value) for value in row[2:]]).encode("utf8"))
+            fingerprint["checksum"] = checksum.hexdigest()
+
+        return fingerprint
+
+
+class PipelineStage(object):
+    """
+    Stage of a pipeline: its name, the names of the datasets it consumes and produces, and the function building them.
+    @param build: function that takes the scratch workspace for outputs of the stage and the input datasets, and returns
+    the output datasets
+    @param diagnostic: outputs are for inspection only, no stage consumes them
+    """
+
+    def __init__(self, name, inputs, outputs, build, message=None, diagnostic=False):
+        self.name = name
+        self.inputs = inputs
+        self.outputs = outputs
+        self.build = build
+        self.message = message
+        self.diagnostic = diagnostic
+
+
+class Pipeline(object):
+    """
+    Pipeline declared as a DAG of stages over named datasets.
+    Running it for requested outputs plans the stages producing them and, transitively, their inputs, so stages whose
+    outputs nobody consumes do not run. Diagnostic stages run in debug mode only.
+    """
+
+    def __init__(self, debug=False):
+        self.debug = debug
+        self.stages = []
+
+    def stage(self, name, inputs, outputs, build, message=None, diagnostic=False):
+        self.stages.append(PipelineStage(name, inputs, outputs, build, message, diagnostic))
+
+    def plan(self, outputs):
+        """
+        Stages needed for outputs, in order of declaration, which is an order of their dependencies.
+        """
+        needed = set(outputs)
+        planned = []
+        for stage in reversed(self.stages):
+            if (stage.diagnostic and self.debug) or needed.intersection(stage.outputs):
+                planned.append(stage)
+                needed.update(stage.inputs)
+
+        return planned[::-1]
+
+    def run(self, outputs, run_stage):
+        """
+        Run the stages needed for outputs.
+        @param run_stage: function that takes a stage and a function building its outputs from the scratch workspace for
+        them, and returns the outputs, e.g. from a checkpoint
+        @return: requested output datasets
+        """
+        datasets = {}
+        for stage in self.plan(outputs):
+            inputs = [datasets[name] for name in stage.inputs]
+            stage_outputs = run_stage(stage, lambda output_scratch: stage.build(output_scratch, *inputs))
+            datasets.update(zip(stage.outputs, stage_outputs))
+
+        return [datasets[name] for name in outputs]
+
+
+class StageCheckpoints(object):
+    """
+    Checkpoints of the pipeline stages of one chain, e.g. one boundary.
+    Once a stage is done, its outputs, the parameters and the fingerprint of the chain inputs are recorded in a manifest,
+    and its outputs are kept in a file geodatabase of the chain. On restart, stages are resumed from their checkpoint
+    while it is valid: same inputs and parameters, outputs still there, and no stage before it had to run again.
+    """
+
+    # fingerprints of inputs shared by chains, e.g. routes, computed once per process
+    fingerprints = {}
+
+    def __init__(self, folder, name, inputs, parameters):
+        self.folder = folder
+        self.name = name
+        self.manifest_path = os.path.join(folder, "{0}.json".format(name))
+        self.resuming = True
+
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+
+        fingerprint = {"inputs": [self.fingerprint_dataset(dataset) for dataset in inputs],
+                       "parameters": [str(parameter) for parameter in parameters]}
+        self.key = hashlib.sha1(json.dumps(fingerprint, sort_keys=True).encode("utf8")).hexdigest()
+
+        self.manifest = {"chain": name, "key": self.key, "fingerprint": fingerprint, "stages": {}}
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as manifest_file:
+                manifest = json.load(manifest_file)
+            if manifest.get("key") == self.key:
+                self.manifest = manifest
+            else:
+                logger.info("Inputs or parameters of {0} changed since its checkpoints, starting over".format(name))
+
+    def run(self, stage, build):
+        """
+        Outputs of stage from its checkpoint, or built again, along with all stages after it.
+        @param build: function that takes the scratch workspace for outputs of the stage and returns them
+        @return: output datasets
+        """
+        checkpoint = self.manifest["stages"].get(stage)
+        if self.resuming and checkpoint and all(arcpy.Exists(output) for output in checkpoint["outputs"]):
+            logger.info("Resuming {0} {1} from checkpoint of {2}".format(self.name, stage, checkpoint["completed"]))
+            return checkpoint["outputs"]
+
+        # outputs of a stage are invalid while it runs
+        self.resuming = False
+        self.manifest["stages"].pop(stage, None)
+        self.write_manifest()
+
+        outputs = list(build(ScratchWorkspace(self.workspace())))
+
+        self.manifest["stages"][stage] = {"outputs": outputs, "completed": datetime.now().isoformat()}
+        self.write_manifest()
+        return outputs
+
+    def workspace(self):
+        workspace = os.path.join(self.folder, "{0}.gdb".format(self.name))
+        if not arcpy.Exists(workspace):
+            arcpy.CreateFileGDB_management(self.folder, os.path.basename(workspace))
+
+        return workspace
+
+    def write_manifest(self):
+        PreprocessCache.write_manifest(self.manifest_path, self.manifest)
+
+    @classmethod
+    def fingerprint_dataset(cls, dataset):
+        key = os.path.join(arcpy.env.workspace or "", dataset)
+        if key not in cls.fingerprints:
+            cls.fingerprints[key] = PreprocessCache.fingerprint_dataset(dataset)
+
+        return cls.fingerprints[key]
+
+    @staticmethod
+    def clear(folder):
+        """
+        Remove checkpoints of all chains, once the run is complete.
+        """
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+class ScratchWorkspace(object):
+    """
+    Locations of intermediate datasets.
+    Intermediates are written to memory ("in_memory"), to a local scratch file geodatabase (a folder), or by default to
+    the workspace itself. In memory, intermediates spill to the local scratch geodatabase once the process uses more
+    than memory_budget_mb. Intermediates matching a keep pattern, and diagnostic outputs in debug mode, are always
+    written to keep_workspace.
+    """
+
+    def __init__(self, workspace, scratch=None, memory_budget_mb=2048, keep=None, keep_workspace=None, debug=False):
+        self.workspace = workspace
+        self.scratch = scratch
+        self.memory_budget_mb = memory_budget_mb
+        self.keep = keep or []
+        self.keep_workspace = keep_workspace or workspace
+        self.debug = debug
+        self.spilled = False
+        self.created = []
+
+    def fork(self, workspace=None):
+        """
+        New scratch workspace with the same settings, e.g. for one boundary in a worker.
+        """
+        return ScratchWorkspace(workspace or self.workspace, self.scratch, self.memory_budget_mb, self.keep, self.keep_workspace, self.debug)
+
+    def kept(self, name):
+        """
+        Whether a dataset matches a keep pattern.
+        """
+        return any(fnmatch.fnmatch(name, pattern) for pattern in self.keep)
+
+    def keep_path(self, name):
+        """
+        Path of a dataset always kept, e.g. a diagnostic output.
+        """
+        return os.path.join(self.keep_workspace, name)
+
+    def path(self, name, allow_memory=True):
+        if self.kept(name):
+            return self.keep_path(name)
+
+        if not self.scratch:
+            return os.path.join(self.workspace, name)
+
+        if self.scratch == "in_memory" and allow_memory and not self.spilled:
+            memory_mb = get_process_memory_mb()
+            if memory_mb <= self.memory_budget_mb:
+                return self.track("in_memory\\{0}".format(name))
+
+            logger.warning("Process uses {0:.0f} MB, spilling intermediates to {1}".format(memory_mb, self.local_workspace()))
+            self.spilled = True
+
+        return self.track(os.path.join(self.local_workspace(), name))
+
+    def local_workspace(self):
+        local_workspace = self.get_local_workspace_path()
+        if not arcpy.Exists(local_workspace):
+            arcpy.CreateFileGDB_management(os.path.dirname(local_workspace), os.path.basename(local_workspace))
+
+        return local_workspace
+
+    def get_local_workspace_path(self):
+        # one geodatabase per process, so workers never share one
+        folder = tempfile.gettempdir() if self.scratch == "in_memory" else self.scratch
+        return os.path.join(folder, "border_route_scratch_{0}.gdb".format(os.getpid()))
+
+    def delete_local_workspace(self):
+        """
+        Delete the local scratch geodatabase of this process, shared by all its scratch workspaces, once the run or the
+        worker is done with it.
+        """
+        if not self.scratch:
+            return
+
+        local_workspace = self.get_local_workspace_path()
+        try:
+            if arcpy.Exists(local_workspace):
+                arcpy.Delete_management(local_workspace)
+        except Exception:
+            logger.warning("Failed to delete scratch geodatabase {0}: {1}".format(local_workspace, traceback.format_exc().strip().splitlines()[-1]))
+
+    def track(self, dataset):
+        self.created.append(dataset)
+        return dataset
+
+    def clear(self):
+        """
+        Delete intermediates written to memory or local scratch geodatabase.
+        """
+        for dataset in reversed(self.created):
+            if arcpy.Exists(dataset):
+                arcpy.Delete_management(dataset)
+        self.created = []
+
+
+class RunReport(object):
+    """
+    Instrumentation of a run: elapsed time, input and output feature counts, vertex counts and process memory of every
+    stage and of every geoprocessing call in it. While instrumenting, geoprocessing tools of arcpy are wrapped, so the
+    pipeline calls them as usual. Stages run until the next stage begins. Records of workers are passed back to the
+    parent and merged, and the whole run is written as a JSON report and logged as a summary table.
+    """
+
+    # toolbox suffixes of wrapped geoprocessing tools
+    TOOLBOXES = ("analysis", "management", "lr", "conversion", "cartography")
+
+    # tools not worth counting features of
+    UNCOUNTED_TOOLS = ("GetCount_management", "Delete_management", "CreateFileGDB_management", "CreateTable_management")
+
+    def __init__(self):
+        self.enabled = False
+        self.count_vertices = False
+        self.tools = {}
+        self.started = time.time()
+        self.stages = []
+        self.calls = []
+        self.stage = None
+
+    def configure(self, enabled, count_vertices=False):
+        self.enabled = enabled
+        self.count_vertices = count_vertices
+        if enabled:
+            self.instrument()
+
+    def instrument(self):
+        if not arcpy or self.tools:
+            return
+
+        for name in dir(arcpy):
+            if "_" in name and name.rsplit("_", 1)[1] in self.TOOLBOXES and callable(getattr(arcpy, name)):
+                self.tools[name] = getattr(arcpy, name)
+                setattr(arcpy, name, self.wrap(name, self.tools[name]))
+
+    def restore(self):
+        for name, tool in self.tools.items():
+            setattr(arcpy, name, tool)
+        self.tools = {}
+
+    def wrap(self, name, tool):
+        def instrumented_tool(*args, **kwargs):
+            counted = name not in self.UNCOUNTED_TOOLS
+            input_dataset = args[0] if args else None
+            input_count = self.count_features(input_dataset) if counted else None
+            input_vertices = self.count_dataset_vertices(input_dataset) if counted else None
+
+            started = time.time()
+            result = tool(*args, **kwargs)
+            seconds = time.time() - started
+
+            output_dataset = result.getOutput(0) if counted and getattr(result, "outputCount", 0) else None
+            self.record_call(name, seconds, input_count, self.count_features(output_dataset),
+                             input_vertices, self.count_dataset_vertices(output_dataset))
+            return result
+
+        instrumented_tool.__name__ = name
+        return instrumented_tool
+
+    def begin_stage(self, name):
+        """
+        Begin a stage, ending the current one. Stages without name are recorded only if they are named when ended.
+        """
+        self.end_stage()
+        if self.enabled:
+            self.stage = {"stage": name, "process": os.getpid(), "started": time.time(), "seconds": 0, "calls": 0,
+                          "gp_seconds": 0, "input_count": None, "output_count": None, "memory_mb": None}
+
+    def end_stage(self, name=None, output_count=None):
+        """
+        End the current stage, if any, and begin an unnamed one.
+        @param name: name of the stage, for stages named only when done, e.g. the shapely backend stages
+        @param output_count: features or rows produced by the stage, if not counted from its geoprocessing calls
+        """
+        stage, self.stage = self.stage, None
+        if not stage:
+            return
+
+        stage["stage"] = name or stage["stage"]
+        stage["seconds"] = time.time() - stage["started"]
+        stage["memory_mb"] = get_process_memory_mb()
+        if output_count is not None:
+            stage["output_count"] = output_count
+        if stage["stage"]:
+            self.stages.append(stage)
+            logger.info("Stage {0}: {1:.2f} s, {2} calls, {3} features, {4:.0f} MB".format(
+                stage["stage"], stage["seconds"], stage["calls"], stage["output_count"], stage["memory_mb"]))
+
+        if name:
+            self.begin_stage(None)
+
+    def record_call(self, tool, seconds, input_count, output_count, input_vertices=None, output_vertices=None):
+        stage = self.stage or {}
+        self.calls.append({"tool": tool, "stage": stage.get("stage"), "process": os.getpid(), "seconds": seconds,
+                           "input_count": input_count, "output_count": output_count, "input_vertices": input_vertices,
+                           "output_vertices": output_vertices, "memory_mb": get_process_memory_mb()})
+        if self.stage:
+            self.stage["calls"] += 1
+            self.stage["gp_seconds"] += seconds
+            if self.stage["input_count"] is None:
+                self.stage["input_count"] = input_count
+            if output_count is not None:
+                self.stage["output_count"] = output_count
+
+    def count_features(self, dataset):
+        if not dataset or isinstance(dataset, (list, tuple)) and not all(dataset):
+            return None
+        if isinstance(dataset, (list, tuple)):
+            counts = [self.count_features(item) for item in dataset]
+            return None if None in counts else sum(counts)
+
+        try:
+            get_count = self.tools.get("GetCount_management", arcpy.GetCount_management)
+            return int(get_count(dataset).getOutput(0))
+        except Exception:
+            # not a table, feature class or layer
+            return None
+
+    def count_dataset_vertices(self, dataset):
+        if not self.count_vertices or not dataset or isinstance(dataset, (list, tuple)):
+            return None
+
+        try:
+            if not hasattr(arcpy.Describe(dataset), "shapeType"):
+                return None
+            with arcpy.da.SearchCursor(dataset, ["SHAPE@"]) as sCur:
+                return sum(row[0].pointCount for row in sCur if row[0])
+        except Exception:
+            return None
+
+    def pop_records(self):
+        """
+        Records of a worker, to be merged into the report of the parent.
+        """
+        self.end_stage()
+        records = {"stages": self.stages, "calls": self.calls}
+        self.stages = []
+        self.calls = []
+        return records
+
+    def extend(self, records):
+        if records:
+            self.stages.extend(records["stages"])
+            self.calls.extend(records["calls"])
+
+    def write(self, path):
+        self.stages.sort(key=lambda stage: stage["started"])
+        report = {"started": datetime.fromtimestamp(self.started).isoformat(),
+                  "seconds": time.time() - self.started,
+                  "memory_mb": get_process_memory_mb(),
+                  "stages": self.stages,
+                  "calls": self.calls}
+        with open(path, "w") as report_file:
+            json.dump(report, report_file, indent=2)
+        logger.info("Wrote run report to {0}".format(path))
+
+    def summary(self, slowest=10):
+        """
+        Summary table of stages, aggregated over boundaries and tiles of the same stage, and the slowest calls.
+        @return: lines of the table
+        """
+        totals = {}
+        for stage in self.stages:
+            total = totals.setdefault(stage["stage"], {"runs": 0, "seconds": 0, "calls": 0, "output_count": 0, "memory_mb": 0})
+            total["runs"] += 1
+            total["seconds"] += stage["seconds"]
+            total["calls"] += stage["calls"]
+            total["output_count"] += stage["output_count"] or 0
+            total["memory_mb"] = max(total["memory_mb"], stage["memory_mb"])
+
+        lines = ["{0:<60} {1:>5} {2:>10} {3:>6} {4:>10} {5:>10}".format("Stage", "Runs", "Seconds", "Calls", "Features", "Memory MB")]
+        for name, total in sorted(totals.items(), key=lambda item: -item[1]["seconds"]):
+            lines.append("{0:<60} {1:>5} {2:>10.2f} {3:>6} {4:>10} {5:>10.0f}".format(
+                name, total["runs"], total["seconds"], total["calls"], total["output_count"], total["memory_mb"]))
+
+        if self.calls:
+            lines.append("{0:<60} {1:>10} {2:>10} {3:>10}".format("Slowest geoprocessing calls", "Seconds", "Input", "Output"))
+            for call in sorted(self.calls, key=lambda call: -call["seconds"])[:slowest]:
+                lines.append("{0:<60} {1:>10.2f} {2:>10} {3:>10}".format(
+                    "{0} ({1})".format(call["tool"], call["stage"]), call["seconds"], call["input_count"], call["output_count"]))
+
+        return lines
+
+
+# instrumentation of this process, see run_with_report
+run_report = RunReport()
+
+
+def write_profile(profiler, path, top=25):
+    """
+    Write cProfile statistics, and log the functions taking the most cumulative time.
+    """
+    profiler.dump_stats(path)
+    try:
+        from StringIO import StringIO
+    except ImportError:
+        from io import StringIO
+    stream = StringIO()
+    pstats.Stats(profiler, stream=stream).sort_stats("cumulative").print_stats(top)
+    logger.info("Wrote profile to {0}\n{1}".format(path, stream.getvalue()))
+
+
+def get_process_memory_mb():
+    """
+    Resident memory of this process, or peak resident memory where psutil is not installed, 0 where neither is
+    available, e.g. on Windows without psutil.
+    """
+    if psutil:
+        return psutil.Process(os.getpid()).memory_info().rss / 1048576.0
+
+    try:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    except ImportError:
+        return 0
+
+
+def get_folder_size(folder):
+    size = 0
+    for root, directories, files in os.walk(folder):
+        for file_name in files:
+            size += os.path.getsize(os.path.join(root, file_name))
+
+    return size
+
+
 def setup_logger():
     """
     Setup the logger.
@@ -440,7 +2287,7 @@ def setup_logger():
         },
         "loggers": {
             "": {
-                "handlers": ["default", "info_file", "ags"],
+                "handlers": ["default", "info_file", "ags"] if arcpy else ["default", "info_file"],
                 "level": "INFO"
             }
         }
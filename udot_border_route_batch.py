@@ -0,0 +1,170 @@
+"""
+Batch runner of the route border rule table pipeline over configuration sections.
+
+Every section of configuration.ini is a job, e.g. the statewide run and one run per region, each with its own
+WORKSPACE, ROUTE and rule tables. Jobs are queued by their PRIORITY option, higher first, and run in a bounded pool of
+worker processes, which are reused across jobs so arcpy is imported and licensed once per worker, not once per job.
+Every job logs into its own file, and writes its run report next to it. A consolidated status summary of all jobs is
+logged and written as JSON at the end.
+
+Jobs of a pool do not start pools of their own, WORKERS of their sections is used only when jobs run in this process.
+
+Usage:
+    python udot_border_route_batch.py                               # all sections, one after another
+    python udot_border_route_batch.py --sections Default,Region1,Region2 --workers 2
+"""
+
+import os
+import sys
+import json
+import time
+import heapq
+import logging
+import argparse
+import traceback
+from datetime import datetime
+
+from udot_border_route import setup_logger, get_parameters, get_parameter, run_with_report, create_process_pool, get_process_memory_mb
+
+logger = logging.getLogger(__name__)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the route border rule table pipeline for configuration sections")
+    parser.add_argument("--sections", help="configuration sections to run, comma separated, all by default")
+    parser.add_argument("--workers", type=int, default=1, help="worker processes, jobs run in this process if 1")
+    parser.add_argument("--log-folder", default=os.path.join(os.path.dirname(os.path.realpath(__file__)), "batch_logs"),
+                        help="folder of job logs, run reports and the summary")
+    args = parser.parse_args()
+
+    setup_logger()
+    config = get_parameters()
+    sections = [section.strip() for section in args.sections.split(",")] if args.sections else config.sections()
+    unknown = [section for section in sections if not config.has_section(section)]
+    if unknown:
+        sys.exit("Sections {0} are not in configuration.ini. Exit".format(",".join(unknown)))
+
+    log_folder = os.path.join(args.log_folder, datetime.now().strftime("%Y%m%d_%H%M%S"))
+    os.makedirs(log_folder)
+
+    results = run_batch(config, sections, args.workers, log_folder)
+
+    summary_path = os.path.join(log_folder, "batch_summary.json")
+    with open(summary_path, "w") as summary_file:
+        json.dump(results, summary_file, indent=2, sort_keys=True)
+    for line in summarize(results):
+        logger.info(line)
+    logger.info("Wrote batch summary to {0}".format(summary_path))
+
+    if any(result["status"] != "succeeded" for result in results):
+        sys.exit(1)
+
+
+def run_batch(config, sections, workers, log_folder):
+    """
+    Run sections as jobs, highest PRIORITY first, in order of sections among equal priorities.
+    @return: status of every job, in order of completion
+    """
+    queue = []
+    for order, section in enumerate(sections):
+        heapq.heappush(queue, (-float(get_parameter(config, section, "PRIORITY", 0)), order, section))
+    tasks = [(section, log_folder, workers > 1) for priority, order, section in [heapq.heappop(queue) for _ in range(len(queue))]]
+
+    logger.info("Running {0} jobs with {1} workers: {2}".format(len(tasks), max(1, workers), ",".join(task[0] for task in tasks)))
+    results = []
+    if workers > 1:
+        # the pool hands out tasks in order, one at a time, so the queue order holds
+        pool = create_process_pool(min(workers, len(tasks)), setup_logger)
+        try:
+            for result in pool.imap_unordered(run_batch_job, tasks, 1):
+                log_result(result)
+                results.append(result)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for task in tasks:
+            result = run_batch_job(task)
+            log_result(result)
+            results.append(result)
+
+    return results
+
+
+def run_batch_job(task):
+    """
+    Run the pipeline of one configuration section, logging into its own file.
+    @return: status of the job
+    """
+    section, log_folder, in_pool = task
+    log_path = os.path.join(log_folder, "{0}.log".format(section))
+    job_folder = os.path.join(log_folder, section)
+    if not os.path.exists(job_folder):
+        os.makedirs(job_folder)
+
+    handler = logging.FileHandler(log_path, encoding="utf8")
+    handler.setFormatter(logging.Formatter("%(asctime)s [%(levelname)s] %(name)s: %(message)s"))
+    logging.getLogger().addHandler(handler)
+
+    started = time.time()
+    result = {"section": section, "log": log_path, "pid": os.getpid(), "started": datetime.now().isoformat(), "error": None}
+    try:
+        # configuration is read by every job, so edits between nightly runs need no restart of anything
+        config = get_parameters()
+        if in_pool and int(get_parameter(config, section, "WORKERS", 1)) > 1:
+            logger.warning("{0} runs in a batch worker, WORKERS is ignored".format(section))
+            config.set(section, "WORKERS", "1")
+
+        logger.info("Running job {0}...".format(section))
+        if get_parameter(config, section, "BACKEND", "arcpy").lower() == "shapely":
+            import udot_border_route_shapely
+            run_with_report(config, section, udot_border_route_shapely.run, job_folder)
+        else:
+            import udot_border_route
+            run_with_report(config, section, udot_border_route.run, job_folder)
+        result["status"] = "succeeded"
+    except SystemExit as error:
+        # the pipeline exits on failures, which fail this job only
+        logger.error("Job {0} exited: {1}".format(section, error))
+        result["status"] = "failed"
+        result["error"] = str(error)
+    except Exception:
+        logger.error(traceback.format_exc())
+        result["status"] = "failed"
+        result["error"] = traceback.format_exc().strip().splitlines()[-1]
+    finally:
+        logging.getLogger().removeHandler(handler)
+        handler.close()
+
+    result["seconds"] = time.time() - started
+    # memory of the worker process, not of this job, see summarize
+    result["worker_memory_mb"] = get_process_memory_mb()
+
+    return result
+
+
+def log_result(result):
+    if result["status"] == "succeeded":
+        logger.info("Job {0} succeeded in {1:.1f} s".format(result["section"], result["seconds"]))
+    else:
+        logger.error("Job {0} failed in {1:.1f} s: {2}, see {3}".format(result["section"], result["seconds"], result["error"], result["log"]))
+
+
+def summarize(results):
+    """
+    Status table of all jobs. Workers are reused across jobs, so the memory column is the resident memory of the worker
+    after the job, or its peak memory over all its jobs so far where psutil is not installed.
+    @return: lines of the table
+    """
+    lines = ["{0:<30} {1:<10} {2:>10} {3:>10} {4:>8}  {5}".format("job", "status", "seconds", "worker MB", "pid", "error")]
+    for result in sorted(results, key=lambda result: result["started"]):
+        lines.append("{0:<30} {1:<10} {2:>10.1f} {3:>10.1f} {4:>8}  {5}".format(
+            result["section"], result["status"], result["seconds"], result["worker_memory_mb"], result["pid"], result["error"] or ""))
+    failed = len([result for result in results if result["status"] != "succeeded"])
+    lines.append("{0} jobs, {1} succeeded, {2} failed".format(len(results), len(results) - failed, failed))
+
+    return lines
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+"""
+Benchmark of the route border rule table pipeline on synthetic data.
+
+Boundaries are nested grids of cities in counties in regions, with jagged shared edges. Routes are a mix of routes
+running along borders, crossing borders at high angles, zig-zagging across borders within OFFSET, and routes away
+from borders. Sizes are numbers of route segments, the lines between consecutive route vertices, routes are generated
+until there are as many. The pipeline runs on the shapely backend at several sizes, every size in its own process, recording wall
+time, peak memory and rows produced per stage. Results are written as JSON, and compared with the results of a
+baseline run to flag regressions.
+
+Usage:
+    python udot_border_route_benchmark.py --sizes 1000,10000,100000 --output results.json --baseline previous.json
+"""
+
+import sys
+import json
+import time
+import math
+import random
+import argparse
+import platform
+import multiprocessing
+from datetime import datetime
+
+import numpy
+import shapely
+from shapely.geometry import Polygon, LineString
+
+import udot_border_route_shapely
+from udot_border_route import get_process_memory_mb
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+BOUNDARY_LEVELS = [("city", "CITY_NAME"), ("county", "COUNTY_NAME"), ("region", "REGION_NAME")]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the route border rule table pipeline on synthetic data")
+    parser.add_argument("--sizes", default="1000,10000,100000", help="numbers of route segments, comma separated")
+    parser.add_argument("--along", type=float, default=0.3, help="fraction of routes running along borders")
+    parser.add_argument("--crossing", type=float, default=0.2, help="fraction of routes crossing borders at high angles")
+    parser.add_argument("--zigzag", type=float, default=0.1, help="fraction of routes zig-zagging across borders within offset")
+    parser.add_argument("--jaggedness", type=int, default=8, help="vertices added to every boundary edge")
+    parser.add_argument("--buffer-size", type=float, default=25.0)
+    parser.add_argument("--offset", type=float, default=10.0)
+    parser.add_argument("--high-angle-threshold", type=float, default=20.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--label", default="", help="label of this run, e.g. a version")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", help="results of a previous run to compare with")
+    parser.add_argument("--threshold", type=float, default=1.25, help="slowdown ratio flagged as regression")
+    args = parser.parse_args()
+
+    parameters = {"along": args.along, "crossing": args.crossing, "zigzag": args.zigzag, "jaggedness": args.jaggedness,
+                  "buffer_size": args.buffer_size, "offset": args.offset, "high_angle_threshold": args.high_angle_threshold,
+                  "seed": args.seed}
+
+    results = {"label": args.label,
+               "timestamp": datetime.now().isoformat(),
+               "python": platform.python_version(),
+               "shapely": shapely.__version__,
+               "numpy": numpy.__version__,
+               "parameters": parameters,
+               "sizes": []}
+
+    for size in [int(size) for size in args.sizes.split(",")]:
+        # one process per size, so peak memory is the peak of this size
+        pool = multiprocessing.Pool(1, maxtasksperchild=1)
+        try:
+            result = pool.apply(run_benchmark, (size, parameters))
+        finally:
+            pool.close()
+            pool.join()
+
+        print("{0:>8} route segments in {1:>6} routes: {2:8.2f} s, {3:8.1f} MB peak, {4} rule rows".format(
+            result["segments"], result["routes"], result["seconds"], result["peak_memory_mb"], result["rows"]))
+        results["sizes"].append(result)
+
+    with open(args.output, "w") as output_file:
+        json.dump(results, output_file, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare_results(json.load(baseline_file), results, args.threshold)
+        for regression in regressions:
+            print("REGRESSION {0}".format(regression))
+        if regressions:
+            sys.exit(1)
+
+
+def run_benchmark(size, parameters):
+    """
+    Generate data of a size and run the pipeline on it for all boundary levels.
+    @return: wall time, peak memory and rows of every stage
+    """
+    rng = random.Random(parameters["seed"])
+    boundaries, edges = generate_boundaries(size, parameters["jaggedness"], rng)
+    route_features = generate_routes(size, edges, parameters, rng)
+
+    stages = []
+    started = time.time()
+    stage_started = [started]
+
+    def record(stage, rows):
+        now = time.time()
+        stages.append({"stage": stage, "seconds": now - stage_started[0], "rows": rows, "memory_mb": get_process_memory_mb()})
+        stage_started[0] = now
+
+    route_lines = udot_border_route_shapely.get_route_lines(route_features, "ROUTE_ID")
+    record("get_route_lines", len(route_lines))
+
+    rows = 0
+    for level, boundary_id_field in BOUNDARY_LEVELS:
+        level_rows = udot_border_route_shapely.generate_route_border_rule_rows(
+            route_lines, boundaries[level], boundary_id_field, parameters["buffer_size"], parameters["high_angle_threshold"],
+            parameters["offset"], stage_callback=lambda stage, count: record("{0}.{1}".format(level, stage), count))
+        rows += len(level_rows)
+
+    return {"size": size,
+            "routes": len(route_features),
+            "segments": int(sum(shapely.get_num_coordinates(line) - 1 for line, properties in route_features)),
+            "boundaries": dict((level, len(features)) for level, features in boundaries.items()),
+            "seconds": time.time() - started,
+            "peak_memory_mb": get_peak_memory_mb(),
+            "rows": rows,
+            "stages": stages}
+
+
+def compare_results(baseline, results, threshold, min_seconds=0.1):
+    """
+    Stages slower than the baseline by threshold, and stages producing a different number of rows.
+    """
+    baseline_stages = dict(((result["size"], stage["stage"]), stage) for result in baseline["sizes"] for stage in result["stages"])
+
+    regressions = []
+    for result in results["sizes"]:
+        for stage in result["stages"]:
+            baseline_stage = baseline_stages.get((result["size"], stage["stage"]))
+            if not baseline_stage:
+                continue
+
+            if stage["seconds"] > baseline_stage["seconds"] * threshold and stage["seconds"] - baseline_stage["seconds"] > min_seconds:
+                regressions.append("{0} at {1}: {2:.2f} s, was {3:.2f} s".format(
+                    stage["stage"], result["size"], stage["seconds"], baseline_stage["seconds"]))
+            if stage["rows"] != baseline_stage["rows"]:
+                regressions.append("{0} at {1}: {2} rows, was {3}".format(stage["stage"], result["size"], stage["rows"], baseline_stage["rows"]))
+
+    return regressions
+
+
+def generate_boundaries(size, jaggedness, rng, cell_size=5000.0, cities_per_county_side=3, counties_per_region_side=2,
+                        unincorporated_fraction=0.2):
+    """
+    Nested boundaries: a grid of city cells, counties of cities_per_county_side^2 cells, regions of
+    counties_per_region_side^2 counties. Grid nodes are jittered and every edge gets jaggedness vertices, generated once
+    so neighbors share them. A fraction of cells is unincorporated, they are in counties but not in cities.
+    About 100 route segments per cell.
+    @return: ({level: [(polygon, properties)]}, [interior edge coordinates])
+    """
+    block = cities_per_county_side * counties_per_region_side
+    cells_per_side = max(block, int(math.ceil(math.sqrt(size / 100.0) / block)) * block)
+
+    # jittered grid nodes
+    nodes = numpy.zeros((cells_per_side + 1, cells_per_side + 1, 2))
+    for i in range(cells_per_side + 1):
+        for j in range(cells_per_side + 1):
+            interior = 0 < i < cells_per_side and 0 < j < cells_per_side
+            jitter = cell_size * 0.2 if interior else 0
+            nodes[i, j] = (i * cell_size + rng.uniform(-jitter, jitter), j * cell_size + rng.uniform(-jitter, jitter))
+
+    edges = {}
+
+    def edge(start, end, key):
+        if key not in edges:
+            fractions = numpy.linspace(0, 1, jaggedness + 2)
+            coordinates = start + numpy.outer(fractions, end - start)
+            normal = numpy.array([start[1] - end[1], end[0] - start[0]]) / numpy.hypot(*(end - start))
+            noise = numpy.array([0] + [rng.uniform(-1, 1) * cell_size * 0.05 for _ in range(jaggedness)] + [0])
+            edges[key] = coordinates + numpy.outer(noise, normal)
+        return edges[key]
+
+    cells = {}
+    for i in range(cells_per_side):
+        for j in range(cells_per_side):
+            bottom = edge(nodes[i, j], nodes[i + 1, j], ("h", i, j))
+            right = edge(nodes[i + 1, j], nodes[i + 1, j + 1], ("v", i + 1, j))
+            top = edge(nodes[i, j + 1], nodes[i + 1, j + 1], ("h", i, j + 1))
+            left = edge(nodes[i, j], nodes[i, j + 1], ("v", i, j))
+            cells[i, j] = Polygon(numpy.concatenate((bottom[:-1], right[:-1], top[::-1][:-1], left[::-1][:-1])))
+
+    cities = []
+    counties = {}
+    regions = {}
+    for (i, j), cell in sorted(cells.items()):
+        county = "COUNTY_{0}_{1}".format(i // cities_per_county_side, j // cities_per_county_side)
+        region = "REGION_{0}_{1}".format(i // block, j // block)
+        counties.setdefault(county, []).append(cell)
+        regions.setdefault(region, []).append(cell)
+        if rng.random() >= unincorporated_fraction:
+            cities.append((cell, {"CITY_NAME": "CITY_{0}_{1}".format(i, j)}))
+
+    boundaries = {"city": cities,
+                  "county": [(shapely.union_all(parts), {"COUNTY_NAME": name}) for name, parts in sorted(counties.items())],
+                  "region": [(shapely.union_all(parts), {"REGION_NAME": name}) for name, parts in sorted(regions.items())]}
+
+    interior_edges = [coordinates for (kind, i, j), coordinates in sorted(edges.items())
+                      if (kind == "h" and 0 < j < cells_per_side) or (kind == "v" and 0 < i < cells_per_side)]
+
+    return boundaries, interior_edges
+
+
+def generate_routes(size, edges, parameters, rng):
+    """
+    Routes with measures: along borders, crossing borders, zig-zagging across borders within offset, and random, until
+    they have size segments.
+    @return: [(line, properties)]
+    """
+    offset = parameters["offset"]
+    routes = []
+    segments = 0
+    index = 0
+    while segments < size:
+        index += 1
+        edge = edges[rng.randrange(len(edges))]
+        draw = rng.random()
+
+        if draw < parameters["along"]:
+            # along border, off it by less than the offset
+            line = shapely.offset_curve(LineString(edge), rng.uniform(-0.5, 0.5) * offset)
+            coordinates = numpy.asarray(line.coords) if line.geom_type == "LineString" else edge
+        elif draw < parameters["along"] + parameters["crossing"]:
+            # crossing border at a high angle
+            middle = edge[len(edge) // 2]
+            direction = edge[-1] - edge[0]
+            normal = numpy.array([-direction[1], direction[0]]) / numpy.hypot(*direction)
+            half_length = rng.uniform(0.05, 0.3) * numpy.hypot(*direction)
+            coordinates = numpy.array([middle - normal * half_length, middle + normal * half_length])
+        elif draw < parameters["along"] + parameters["crossing"] + parameters["zigzag"]:
+            # zig-zag across border within offset
+            line = LineString(edge)
+            distances = numpy.arange(0, line.length, 4 * offset)
+            points = shapely.get_coordinates(shapely.line_interpolate_point(line, distances))
+            direction = edge[-1] - edge[0]
+            normal = numpy.array([-direction[1], direction[0]]) / numpy.hypot(*direction)
+            sides = numpy.where(numpy.arange(len(points)) % 2 == 0, 0.8, -0.8) * offset
+            coordinates = points + numpy.outer(sides, normal)
+        else:
+            # away from border
+            start = edge[0] + numpy.array([rng.uniform(-0.4, 0.4), rng.uniform(-0.4, 0.4)]) * numpy.hypot(*(edge[-1] - edge[0]))
+            angle = rng.uniform(0, 2 * math.pi)
+            coordinates = numpy.array([start, start + numpy.array([math.cos(angle), math.sin(angle)]) * rng.uniform(100, 2000)])
+
+        if len(coordinates) < 2:
+            continue
+
+        segments += len(coordinates) - 1
+        measures = numpy.concatenate(([0], numpy.cumsum(numpy.hypot(numpy.diff(coordinates[:, 0]), numpy.diff(coordinates[:, 1])))))
+        routes.append((LineString(numpy.column_stack((coordinates[:, :2], measures))),
+                       {"ROUTE_ID": "R{0:07d}".format(index), "START_DATE": None, "END_DATE": None}))
+
+    return routes
+
+
+def get_peak_memory_mb():
+    if resource:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # bytes on macOS, kilobytes elsewhere
+        return peak / 1048576.0 if sys.platform == "darwin" else peak / 1024.0
+
+    return get_process_memory_mb()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+"""
+Lookup index of the route border rule tables: left and right boundary of routes at measures.
+
+The index is compiled from the rule tables of all boundary levels into one binary file. Routes and boundary ids are
+interned into sorted arrays, and every level holds, route by route, the sorted start and end measures of its spans,
+the running maximum of their ends, and the interned left and right boundary ids. The file is memory-mapped read only, so processes opening it share one
+copy through the page cache, and batches of (route id, measure) events are answered for all levels in one vectorized
+binary search instead of attribute queries against the rule tables.
+
+Usage:
+    python udot_border_route_index.py                 # build INDEX_PATH from the rule tables of configuration.ini
+
+    index = RuleTableIndex(path)
+    sides = index.lookup(["0015P", "0089N"], [12.5, 301.2])
+    left_ids, right_ids = sides["ROUTE_CITY_RULE_SRC"]
+"""
+
+import os
+import json
+import logging
+
+import numpy
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"UDOTBRI1"
+
+# arrays start at multiples of ALIGNMENT bytes
+ALIGNMENT = 64
+
+
+def build_index(path, level_rows):
+    """
+    Compile rule table rows of boundary levels into an index file.
+    @param level_rows: {level, e.g. the rule table name: [rule table rows]}
+    """
+    level_rows = dict((level, [row for row in rows if row[0] is not None and row[1] is not None and row[2] is not None])
+                      for level, rows in level_rows.items())
+
+    route_ids = sorted(set(str(row[0]) for rows in level_rows.values() for row in rows))
+    boundary_ids = sorted(set(str(value) for rows in level_rows.values() for row in rows for value in row[3:5] if value is not None))
+    route_array = encode_strings(route_ids)
+    boundary_array = encode_strings(boundary_ids)
+    route_indexes = dict((route_id, index) for index, route_id in enumerate(route_ids))
+    boundary_indexes = dict((boundary_id, index) for index, boundary_id in enumerate(boundary_ids))
+
+    arrays = {"route_ids": route_array, "boundary_ids": boundary_array}
+    for level, rows in sorted(level_rows.items()):
+        spans = sorted((route_indexes[str(row[0])], min(row[1], row[2]), max(row[1], row[2]),
+                        boundary_indexes[str(row[3])] if row[3] is not None else -1,
+                        boundary_indexes[str(row[4])] if row[4] is not None else -1) for row in rows)
+        span_routes = numpy.array([span[0] for span in spans], dtype=numpy.int64)
+
+        arrays["{0}.route_offsets".format(level)] = numpy.searchsorted(span_routes, numpy.arange(len(route_ids) + 1)).astype(numpy.int64)
+        arrays["{0}.starts".format(level)] = numpy.array([span[1] for span in spans], dtype=numpy.float64)
+        arrays["{0}.ends".format(level)] = numpy.array([span[2] for span in spans], dtype=numpy.float64)
+        arrays["{0}.max_ends".format(level)] = get_max_ends(arrays["{0}.route_offsets".format(level)], arrays["{0}.ends".format(level)])
+        arrays["{0}.left".format(level)] = numpy.array([span[3] for span in spans], dtype=numpy.int32)
+        arrays["{0}.right".format(level)] = numpy.array([span[4] for span in spans], dtype=numpy.int32)
+
+    write_arrays(path, arrays, {"levels": sorted(level_rows)})
+    logger.info("Wrote index of {0} routes, {1} boundaries and {2} spans to {3}".format(
+        len(route_ids), len(boundary_ids), sum(len(rows) for rows in level_rows.values()), path))
+
+
+class RuleTableIndex(object):
+    """
+    Memory-mapped lookup index, see build_index.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.header, self.arrays = read_arrays(path)
+        self.levels = self.header["levels"]
+        self.route_ids = self.arrays["route_ids"]
+        self.boundary_ids = self.arrays["boundary_ids"]
+        self.boundary_id_strings = numpy.array([None] + [value.decode("utf8") for value in self.boundary_ids], dtype=object)
+
+        # indexes built before running maxima of span ends were stored
+        for level in self.levels:
+            if "{0}.max_ends".format(level) not in self.arrays:
+                self.arrays["{0}.max_ends".format(level)] = get_max_ends(self.arrays["{0}.route_offsets".format(level)], self.arrays["{0}.ends".format(level)])
+
+    def lookup(self, route_ids, measures, levels=None, decode=True):
+        """
+        Left and right boundary of routes at measures, for every level.
+        @param route_ids: route id of every event
+        @param measures: measure of every event
+        @param decode: return boundary ids as strings, otherwise as indexes into boundary_ids, -1 where there is none
+        @return: {level: (left ids, right ids)}, None where the route is not along a border of the level at the measure
+        """
+        measures = numpy.asarray(measures, dtype=numpy.float64)
+        routes = self.find_routes(route_ids)
+
+        sides = {}
+        for level in levels or self.levels:
+            spans = self.find_spans(level, routes, measures)
+            found = spans >= 0
+            left = numpy.full(len(spans), -1, dtype=numpy.int64)
+            right = numpy.full(len(spans), -1, dtype=numpy.int64)
+            left[found] = self.arrays["{0}.left".format(level)][spans[found]]
+            right[found] = self.arrays["{0}.right".format(level)][spans[found]]
+            sides[level] = (self.boundary_id_strings[left + 1], self.boundary_id_strings[right + 1]) if decode else (left, right)
+
+        return sides
+
+    def find_routes(self, route_ids):
+        """
+        Index of every route id in route_ids of the index, -1 for unknown routes.
+        """
+        encoded = [str(route_id).encode("utf8") for route_id in route_ids]
+        if len(self.route_ids) == 0:
+            return numpy.full(len(encoded), -1, dtype=numpy.int64)
+
+        # longer route ids would be truncated to a known one
+        fits = numpy.array([len(value) <= self.route_ids.dtype.itemsize for value in encoded], dtype=bool)
+        keys = numpy.array(encoded, dtype=self.route_ids.dtype) if encoded else numpy.zeros(0, dtype=self.route_ids.dtype)
+        routes = numpy.minimum(numpy.searchsorted(self.route_ids, keys), len(self.route_ids) - 1)
+
+        return numpy.where(fits & (self.route_ids[routes] == keys), routes, -1)
+
+    def find_spans(self, level, routes, measures):
+        """
+        Span of every event, the last span of its route starting at or before its measure if it ends at or after it,
+        by binary searches over the spans of every event's route at once. Spans may overlap, so otherwise the spans
+        starting before are searched for the first one whose running maximum of ends reaches the measure, which is the
+        first one ending at or after it.
+        @return: span indexes, -1 where there is none
+        """
+        offsets = self.arrays["{0}.route_offsets".format(level)]
+        starts = self.arrays["{0}.starts".format(level)]
+        ends = self.arrays["{0}.ends".format(level)]
+        max_ends = self.arrays["{0}.max_ends".format(level)]
+        if len(starts) == 0 or len(routes) == 0:
+            return numpy.full(len(routes), -1, dtype=numpy.int64)
+
+        known = routes >= 0
+        first = numpy.where(known, offsets[numpy.maximum(routes, 0)], 0)
+        last = numpy.where(known, offsets[numpy.maximum(routes, 0) + 1], 0)
+
+        # first span starting after the measure, the one before it covers the measure unless spans overlap
+        after = search_first(starts, first, last, lambda values: values > measures)
+        spans = after - 1
+        covered = (spans >= first) & (ends[numpy.maximum(spans, 0)] >= measures)
+
+        # first span starting before the measure ending at or after it
+        overlapping = search_first(max_ends, first, after, lambda values: values >= measures)
+
+        return numpy.where(covered, spans, numpy.where(overlapping < after, overlapping, -1))
+
+
+def search_first(values, low, high, condition):
+    """
+    Index of the first value between low and high meeting condition, for every event at once, high where none does.
+    Condition is monotonic over values between low and high, false then true.
+    """
+    low = low.copy()
+    high = high.copy()
+    active = low < high
+    while active.any():
+        middle = (low + high) // 2
+        met = condition(values[numpy.minimum(middle, len(values) - 1)])
+        low = numpy.where(active & ~met, middle + 1, low)
+        high = numpy.where(active & met, middle, high)
+        active = low < high
+
+    return low
+
+
+def get_max_ends(route_offsets, ends):
+    """
+    Running maximum of span ends, route by route.
+    """
+    max_ends = numpy.empty(len(ends), dtype=numpy.float64)
+    for start, end in zip(route_offsets[:-1], route_offsets[1:]):
+        max_ends[start:end] = numpy.maximum.accumulate(ends[start:end])
+
+    return max_ends
+
+
+def encode_strings(values):
+    """
+    Fixed width UTF-8 array of strings, sortable and searchable by NumPy.
+    """
+    encoded = [value.encode("utf8") for value in values]
+    dtype = "S{0}".format(max([len(value) for value in encoded] or [1]))
+
+    return numpy.array(encoded, dtype=dtype) if encoded else numpy.zeros(0, dtype=dtype)
+
+
+def write_arrays(path, arrays, header):
+    """
+    Write arrays into one file: magic, header length, JSON header describing the arrays, then the aligned arrays.
+    """
+    header = dict(header, arrays={})
+    offset = 0
+    for name, array in sorted(arrays.items()):
+        header["arrays"][name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+        offset += align(array.nbytes)
+
+    header_bytes = json.dumps(header, sort_keys=True).encode("utf8")
+    data_start = align(len(MAGIC) + 8 + len(header_bytes))
+
+    with open(path, "wb") as index_file:
+        index_file.write(MAGIC)
+        index_file.write(numpy.array([len(header_bytes)], dtype="<u8").tobytes())
+        index_file.write(header_bytes)
+        index_file.write(b"\0" * (data_start - index_file.tell()))
+        for name, array in sorted(arrays.items()):
+            data = numpy.ascontiguousarray(array).tobytes()
+            index_file.write(data)
+            index_file.write(b"\0" * (align(len(data)) - len(data)))
+
+
+def read_arrays(path):
+    """
+    Memory-map arrays of a file written by write_arrays.
+    @return: (header, {name: read only array})
+    """
+    with open(path, "rb") as index_file:
+        if index_file.read(len(MAGIC)) != MAGIC:
+            raise ValueError("{0} is not a route border rule index".format(path))
+        header_length = int(numpy.frombuffer(index_file.read(8), dtype="<u8")[0])
+        header = json.loads(index_file.read(header_length).decode("utf8"))
+
+    data_start = align(len(MAGIC) + 8 + header_length)
+    data = numpy.memmap(path, dtype=numpy.uint8, mode="r")
+
+    arrays = {}
+    for name, description in header["arrays"].items():
+        dtype = numpy.dtype(description["dtype"])
+        count = int(numpy.prod(description["shape"])) if description["shape"] else 1
+        start = data_start + description["offset"]
+        arrays[name] = data[start:start + count * dtype.itemsize].view(dtype).reshape(description["shape"])
+
+    return header, arrays
+
+
+def align(size):
+    return (size + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def read_rule_tables(config, section):
+    """
+    Rows of the rule tables of all boundary levels, from the workspace of the configured backend.
+    @return: {rule table: rows}
+    """
+    from udot_border_route import ROUTE_BORDER_RULE_TABLE_FIELDS, get_parameter
+
+    workspace = config.get(section, "WORKSPACE")
+    route_border_rule_tables = [table.strip() for table in config.get(section, "ROUTE_BORDER_RULE_TABLE").split(",")]
+
+    if get_parameter(config, section, "BACKEND", "arcpy").lower() == "shapely":
+        import udot_border_route_shapely
+        return dict((table, udot_border_route_shapely.read_rows(workspace, table, ROUTE_BORDER_RULE_TABLE_FIELDS))
+                    for table in route_border_rule_tables)
+
+    from udot_border_route import read_route_border_rule_rows
+    return dict((table, read_route_border_rule_rows(os.path.join(workspace, table))) for table in route_border_rule_tables)
+
+
+def main():
+    from udot_border_route import setup_logger, get_parameters, get_parameter
+
+    setup_logger()
+    config = get_parameters()
+    index_path = get_parameter(config, "Default", "INDEX_PATH")
+    if not index_path:
+        raise SystemExit("INDEX_PATH is not set. Exit")
+
+    build_index(index_path, read_rule_tables(config, "Default"))
+
+
+if __name__ == "__main__":
+    main()
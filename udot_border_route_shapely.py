@@ -0,0 +1,536 @@
+"""
+arcpy-free backend of udot_border_route, on shapely, NumPy and STRtree spatial indexes.
+
+Stages are the same as the arcpy backend: border extraction, buffering, candidate clip, angle filter, offset split,
+left/right side assignment and sorted rule table rows. Candidate lookups between route segments and boundary edges
+go through STRtree queries instead of full-layer overlays.
+
+Datasets are read from and written to WORKSPACE, which is either a folder of GeoJSON files named <dataset>.geojson
+or a GeoPackage (needs fiona). Route measures are the third coordinate of route vertices, routes without it are
+measured by length. Distances are converted to LINEAR_UNIT, the unit of the data coordinates.
+Left and right are relative to the digitizing direction of routes, as in the arcpy backend, whichever way their
+measures run.
+"""
+
+import os
+import sys
+import json
+import logging
+import collections
+from datetime import datetime
+
+import numpy
+import shapely
+from shapely.geometry import shape
+from shapely.ops import substring
+from shapely.strtree import STRtree
+
+from udot_border_route import ROUTE_BORDER_RULE_TABLE_FIELDS, LINEAR_UNITS_IN_METERS, get_parameter, convert_linear_distance,\
+    calculate_angles, calculate_side_samples, classify_candidate_border_routes, compact_route_border_rule_rows, compare_route_border_rule_rows,\
+    export_route_border_rule_rows, parse_date, run_report
+
+try:
+    import fiona
+except ImportError:
+    fiona = None
+
+logger = logging.getLogger(__name__)
+
+RouteLine = collections.namedtuple("RouteLine", ["route_id", "line", "distances", "measures", "start_date", "end_date"])
+
+# route segments, as distances along route lines
+RouteSegments = collections.namedtuple("RouteSegments", ["route_indexes", "from_distances", "to_distances"])
+
+# distance along routes under which boundary crossings are the same
+DISTANCE_TOLERANCE = 1e-6
+
+
+def run(config, section):
+    workspace = config.get(section, "WORKSPACE")
+    route = config.get(section, "ROUTE")
+    route_id_field = config.get(section, "ROUTE_ID_FIELD").strip()
+    boundaries = config.get(section, "BOUNDARY").split(",")
+    boundaries_id_fields = config.get(section, "BOUNDARY_ID_FIELD").split(",")
+    route_border_rule_tables = config.get(section, "ROUTE_BORDER_RULE_TABLE").split(",")
+    meters_per_unit = LINEAR_UNITS_IN_METERS[get_parameter(config, section, "LINEAR_UNIT", "Meters").lower()]
+    buffer_size = convert_linear_distance(config.get(section, "BUFFER_SIZE"), meters_per_unit)
+    high_angle_threshold = float(config.get(section, "HIGH_ANGLE_THRESHOLD"))
+    offset = convert_linear_distance(config.get(section, "OFFSET"), meters_per_unit)
+    export_folder = get_parameter(config, section, "EXPORT_FOLDER")
+    export_format = get_parameter(config, section, "EXPORT_FORMAT", "csv").lower()
+    compact = get_parameter(config, section, "COMPACT", "True").lower() == "true"
+    compact_tolerance = float(get_parameter(config, section, "COMPACT_TOLERANCE", 0))
+    compact_min_length = float(get_parameter(config, section, "COMPACT_MIN_LENGTH", 0))
+    index_path = get_parameter(config, section, "INDEX_PATH")
+    generalize_tolerance = float(get_parameter(config, section, "GENERALIZE_TOLERANCE_FRACTION", 0)) * offset
+    generalize_validate = get_parameter(config, section, "GENERALIZE_VALIDATE", "False").lower() == "true"
+    generalize_measure_tolerance = get_parameter(config, section, "GENERALIZE_MEASURE_TOLERANCE")
+
+    # differences are measured along routes, in measure units, which have nothing to do with the linear unit of offset
+    if generalize_tolerance > 0 and generalize_validate and not generalize_measure_tolerance:
+        sys.exit("Set GENERALIZE_MEASURE_TOLERANCE, in route measure units, to validate generalization. Exit")
+
+    run_report.begin_stage("route_lines")
+    route_lines = get_route_lines(read_features(workspace, route), route_id_field)
+    run_report.end_stage(output_count=len(route_lines))
+
+    run_report.begin_stage("read_boundaries")
+    boundary_levels = [read_features(workspace, boundary) for boundary in boundaries]
+    run_report.end_stage(output_count=sum(len(boundary_features) for boundary_features in boundary_levels))
+
+    # the pipeline runs on generalized boundaries, much fewer vertices within a fraction of offset
+    full_precision_levels = boundary_levels
+    if generalize_tolerance > 0:
+        run_report.begin_stage("generalize_boundaries")
+        boundary_levels = generalize_boundaries(boundary_levels, generalize_tolerance)
+        for boundary, boundary_features, full_precision_features in zip(boundaries, boundary_levels, full_precision_levels):
+            vertex_count = get_vertex_count(full_precision_features)
+            generalized_vertex_count = get_vertex_count(boundary_features)
+            logger.info("Generalized {0} with tolerance {1}: {2} vertices, {3} before, {4:.1f}% fewer".format(
+                boundary, generalize_tolerance, generalized_vertex_count, vertex_count, 100.0 * (vertex_count - generalized_vertex_count) / max(vertex_count, 1)))
+        run_report.end_stage(output_count=sum(get_vertex_count(boundary_features) for boundary_features in boundary_levels))
+
+    level_rows = {}
+    for boundary, boundary_id_field, route_border_rule_table, boundary_features, full_precision_features in zip(
+            boundaries, boundaries_id_fields, route_border_rule_tables, boundary_levels, full_precision_levels):
+        logger.info("Generating route border rule source table for {0}...".format(boundary))
+
+        run_report.begin_stage(None)
+        rows = generate_route_border_rule_rows(route_lines, boundary_features, boundary_id_field, buffer_size, high_angle_threshold, offset,
+                                               stage_callback=lambda stage, count: run_report.end_stage("{0}.{1}".format(boundary, stage), count))
+
+        # rows on generalized boundaries against a full-precision run
+        if generalize_tolerance > 0 and generalize_validate:
+            run_report.begin_stage(None)
+            reference_rows = generate_route_border_rule_rows(route_lines, full_precision_features, boundary_id_field, buffer_size, high_angle_threshold, offset,
+                stage_callback=lambda stage, count: run_report.end_stage("{0}.full_precision.{1}".format(boundary, stage), count))
+            run_report.begin_stage("{0}.validate_generalization".format(boundary))
+            differences = compare_route_border_rule_rows(rows, reference_rows, float(generalize_measure_tolerance))
+            run_report.end_stage(output_count=len(differences))
+            if differences:
+                logger.warning("{0} differs from the full-precision run in {1} spans longer than {2}, e.g. {3}".format(
+                    route_border_rule_table, len(differences), generalize_measure_tolerance, differences[:5]))
+            else:
+                logger.info("{0} is within {1} of the full-precision run".format(route_border_rule_table, generalize_measure_tolerance))
+        if compact:
+            run_report.begin_stage("{0}.compact".format(boundary))
+            row_count = len(rows)
+            rows = list(compact_route_border_rule_rows(rows, compact_tolerance, compact_min_length))
+            run_report.end_stage(output_count=len(rows))
+            logger.info("Compacted {0} rows into {1}".format(row_count, len(rows)))
+
+        run_report.begin_stage("{0}.write_rows".format(boundary))
+        write_rows(workspace, route_border_rule_table, ROUTE_BORDER_RULE_TABLE_FIELDS, rows)
+        if export_folder:
+            export_route_border_rule_rows(rows, os.path.join(export_folder, "{0}.{1}".format(route_border_rule_table, export_format)))
+        run_report.end_stage(output_count=len(rows))
+        logger.info("Wrote {0} rows to {1}".format(len(rows), route_border_rule_table))
+        level_rows[route_border_rule_table] = rows
+
+    # lookup index of all rule tables, for downstream jobs
+    if index_path:
+        import udot_border_route_index
+        run_report.begin_stage("index")
+        udot_border_route_index.build_index(index_path, level_rows)
+        run_report.end_stage()
+
+
+def generate_route_border_rule_rows(route_lines, boundary_features, boundary_id_field, buffer_size, high_angle_threshold, offset, process_date=None,
+                                    stage_callback=None):
+    """
+    Rule table rows of routes along borders of one boundary layer.
+    @param route_lines: RouteLines, see get_route_lines
+    @param boundary_features: [(polygon, properties)]
+    @param stage_callback: function called with the name and the number of output rows of every stage when it is done
+    @return: rule table rows, sorted by route id and start measure
+    """
+    stage_callback = stage_callback or (lambda stage, count: None)
+    process_date = process_date or datetime.now()
+    polygons = numpy.array([geometry for geometry, properties in boundary_features], dtype=object)
+    polygon_ids = [properties.get(boundary_id_field) for geometry, properties in boundary_features]
+    lines = numpy.array([route_line.line for route_line in route_lines], dtype=object)
+
+    # get all candidate border routes
+    borders = extract_borders(polygons)
+    stage_callback("extract_borders", len(borders))
+    candidates = get_candidate_border_routes(lines, borders, buffer_size)
+    stage_callback("candidate_border_routes", len(candidates.route_indexes))
+
+    # filter out candidate border routes that 'intersects' boundary at high angles
+    positive = filter_candidate_border_routes(lines, candidates, borders, buffer_size, high_angle_threshold)
+    stage_callback("filter_candidate_border_routes", len(positive.route_indexes))
+
+    # split positive candidate border routes by boundary offset, then get their left, right boundary
+    segments, within_offset = split_by_boundary_offset(lines, positive, borders, offset)
+    stage_callback("split_by_boundary_offset", len(segments.route_indexes))
+    left_ids, right_ids = assign_boundary_sides(lines, segments, within_offset, polygons, polygon_ids, offset)
+    stage_callback("assign_boundary_sides", sum(1 for left_id, right_id in zip(left_ids, right_ids) if left_id is not None and right_id is not None))
+
+    rows = []
+    for route_index, from_distance, to_distance, left_id, right_id in zip(segments.route_indexes, segments.from_distances,
+                                                                          segments.to_distances, left_ids, right_ids):
+        if left_id is None or right_id is None:
+            continue
+        route_line = route_lines[route_index]
+        rows.append((route_line.route_id,
+                     float(numpy.interp(from_distance, route_line.distances, route_line.measures)),
+                     float(numpy.interp(to_distance, route_line.distances, route_line.measures)),
+                     left_id, right_id, "polyline", route_line.start_date, route_line.end_date, process_date))
+
+    rows.sort(key=lambda row: ("" if row[0] is None else str(row[0]), row[1]))
+    stage_callback("route_border_rule_rows", len(rows))
+    return rows
+
+
+def get_route_lines(route_features, route_id_field):
+    """
+    Split route features into single part lines with the distance along line and measure of every vertex.
+    """
+    route_lines = []
+    for geometry, properties in route_features:
+        for part in shapely.get_parts(geometry):
+            coordinates = numpy.asarray(part.coords)
+            if len(coordinates) < 2:
+                continue
+
+            distances = numpy.concatenate(([0], numpy.cumsum(numpy.hypot(numpy.diff(coordinates[:, 0]), numpy.diff(coordinates[:, 1])))))
+            measures = coordinates[:, 2] if coordinates.shape[1] > 2 else distances
+            route_lines.append(RouteLine(properties.get(route_id_field), shapely.linestrings(coordinates[:, :2]), distances, measures,
+                                         properties.get("START_DATE"), properties.get("END_DATE")))
+
+    return route_lines
+
+
+def generalize_boundaries(boundary_levels, tolerance):
+    """
+    Simplify polygons of all boundary levels consistently. Polygons of all levels are overlaid into faces, which form a
+    coverage, the faces are simplified together so every edge is simplified once, the same way for the faces on both of
+    its sides, and every polygon is rebuilt as the union of its faces. Neighbor polygons, of the same level or not,
+    neither gap nor overlap.
+    @param boundary_levels: [[(polygon, properties)]] of every level
+    @return: generalized boundary levels
+    """
+    level_polygons = [numpy.array([geometry for geometry, properties in boundary_features], dtype=object) for boundary_features in boundary_levels]
+    if not sum(len(polygons) for polygons in level_polygons):
+        return boundary_levels
+
+    # faces of the overlay of all levels
+    edges = shapely.get_parts(shapely.union_all(shapely.boundary(numpy.concatenate(level_polygons))))
+    faces = shapely.get_parts(shapely.polygonize(edges))
+    simplified_faces = shapely.coverage_simplify(faces, tolerance)
+    face_points = shapely.point_on_surface(faces)
+
+    generalized_levels = []
+    for boundary_features, polygons in zip(boundary_levels, level_polygons):
+        if len(polygons) == 0:
+            generalized_levels.append(boundary_features)
+            continue
+
+        shapely.prepare(polygons)
+        face_indexes, polygon_indexes = STRtree(polygons).query(face_points, predicate="within")
+        polygon_faces = dict(group_by(polygon_indexes, face_indexes))
+        generalized_levels.append([(shapely.union_all(simplified_faces[polygon_faces[index]]) if index in polygon_faces else geometry, properties)
+                                   for index, (geometry, properties) in enumerate(boundary_features)])
+
+    return generalized_levels
+
+
+def get_vertex_count(features):
+    return int(sum(shapely.get_num_coordinates(geometry) for geometry, properties in features))
+
+
+def extract_borders(polygons):
+    """
+    Border lines of boundary polygons, noded, shared edges once.
+    """
+    if len(polygons) == 0:
+        return numpy.array([], dtype=object)
+
+    borders = shapely.line_merge(shapely.union_all(shapely.boundary(polygons)))
+    return shapely.get_parts(borders)
+
+
+def get_candidate_border_routes(lines, borders, buffer_size):
+    """
+    Route segments within buffer_size of borders.
+    """
+    border_buffers = shapely.buffer(borders, buffer_size)
+    line_indexes, buffer_indexes = STRtree(border_buffers).query(lines, predicate="intersects")
+
+    segments = []
+    areas = []
+    for line_index, group in group_by(line_indexes, buffer_indexes):
+        segments.append((line_index, 0.0, shapely.length(lines[line_index])))
+        areas.append(shapely.union_all(border_buffers[group]))
+
+    within, outside = clip_route_segments(lines, to_route_segments(segments), areas)
+    return within
+
+
+def filter_candidate_border_routes(lines, candidates, borders, buffer_size, high_angle_threshold):
+    """
+    Candidate route segments running along a boundary segment within high_angle_threshold.
+    Boundary segments are border lines clipped by a flat buffer around routes, located to candidates within buffer_size.
+    """
+    # clip boundary segments within route buffer
+    route_buffers = shapely.buffer(lines, buffer_size, cap_style="flat")
+    buffer_indexes, border_indexes = STRtree(borders).query(route_buffers, predicate="intersects")
+    boundary_segments = shapely.get_parts(shapely.intersection(borders[border_indexes], route_buffers[buffer_indexes]))
+    boundary_segments = boundary_segments[shapely.get_type_id(boundary_segments) == 1]
+
+    # locate boundary segments along candidate border routes
+    candidate_geometries = get_segment_geometries(lines, candidates)
+    candidate_indexes, segment_indexes = STRtree(boundary_segments).query(candidate_geometries, predicate="dwithin", distance=buffer_size)
+
+    candidate_ids = numpy.arange(len(candidate_geometries))
+    angles_route = calculate_angles(*get_segment_endpoints(lines, candidates))
+    boundary_start = shapely.get_coordinates(shapely.get_point(boundary_segments, 0))
+    boundary_end = shapely.get_coordinates(shapely.get_point(boundary_segments, -1))
+    angles_boundary = calculate_angles(boundary_start[:, 0], boundary_start[:, 1], boundary_end[:, 0], boundary_end[:, 1])
+
+    positive_ids, negative_ids = classify_candidate_border_routes(candidate_ids, angles_route, candidate_indexes,
+                                                                  angles_boundary[segment_indexes], high_angle_threshold)
+
+    return RouteSegments(candidates.route_indexes[positive_ids], candidates.from_distances[positive_ids], candidates.to_distances[positive_ids])
+
+
+def split_by_boundary_offset(lines, segments, borders, offset):
+    """
+    Split route segments into parts within offset of borders and parts out of it.
+    @return: (RouteSegments, within offset flags)
+    """
+    border_offsets = shapely.buffer(borders, offset)
+    geometries = get_segment_geometries(lines, segments)
+    segment_indexes, offset_indexes = STRtree(border_offsets).query(geometries, predicate="intersects")
+
+    clipped = []
+    areas = []
+    intersecting = set()
+    for segment_index, group in group_by(segment_indexes, offset_indexes):
+        clipped.append(segment_index)
+        areas.append(shapely.union_all(border_offsets[group]))
+        intersecting.add(segment_index)
+    within, outside = clip_route_segments(lines, RouteSegments(*[values[clipped] for values in segments]), areas)
+
+    # segments far from any border offset are out of it as a whole
+    far = numpy.array([segment_index for segment_index in range(len(geometries)) if segment_index not in intersecting], dtype=numpy.int64)
+    outside = RouteSegments(*[numpy.concatenate((outside_values, values[far])) for outside_values, values in zip(outside, segments)])
+
+    split = RouteSegments(*[numpy.concatenate((within_values, outside_values)) for within_values, outside_values in zip(within, outside)])
+    within_offset = numpy.concatenate((numpy.ones(len(within.route_indexes), dtype=bool), numpy.zeros(len(outside.route_indexes), dtype=bool)))
+
+    return split, within_offset
+
+
+def assign_boundary_sides(lines, segments, within_offset, polygons, polygon_ids, offset):
+    """
+    Left and right boundary id of route segments, from the polygons containing a point sampled on either side of the
+    middle of every segment. Segments within offset of borders are sampled twice the offset away, across the border;
+    segments out of it are sampled on the segment itself, so left and right are the polygon containing them.
+    @return: (left ids, right ids), None where no polygon contains the sample
+    """
+    count = len(segments.route_indexes)
+    if count == 0:
+        return [], []
+
+    # middle point and direction of segments
+    route_lines = lines[segments.route_indexes]
+    middle_distances = (segments.from_distances + segments.to_distances) / 2.0
+    delta = numpy.minimum((segments.to_distances - segments.from_distances) / 4.0, offset)
+    middle = shapely.get_coordinates(shapely.line_interpolate_point(route_lines, middle_distances))
+    ahead = shapely.get_coordinates(shapely.line_interpolate_point(route_lines, middle_distances + delta))
+    behind = shapely.get_coordinates(shapely.line_interpolate_point(route_lines, middle_distances - delta))
+
+    left_samples, right_samples = calculate_side_samples(middle, ahead, behind, numpy.where(within_offset, 2.0 * offset, 0.0))
+
+    samples = shapely.points(numpy.concatenate((left_samples, right_samples)))
+    ids = locate_points_in_polygons(samples, polygons, polygon_ids)
+
+    return ids[:count], ids[count:]
+
+
+def locate_points_in_polygons(points, polygons, polygon_ids):
+    """
+    Id of the polygon containing every point, through a polygon STRtree with prepared geometries.
+    """
+    ids = [None] * len(points)
+    if len(polygons) == 0:
+        return ids
+
+    shapely.prepare(polygons)
+    point_indexes, polygon_indexes = STRtree(polygons).query(points, predicate="within")
+    for point_index, polygon_index in zip(point_indexes[::-1], polygon_indexes[::-1]):
+        ids[point_index] = polygon_ids[polygon_index]
+
+    return ids
+
+
+def clip_route_segments(lines, segments, areas):
+    """
+    Split route segments into their parts within areas and their parts out of them. Segments are clipped in distance
+    along their route: they are split at the distances their route crosses the area boundary, and every piece is within
+    the area if its middle is. Distances are not located back onto the route, so parts of routes passing an area more
+    than once, e.g. loops and routes crossing themselves, keep the distances they are traversed at.
+    @param areas: area of every segment
+    @return: (RouteSegments within areas, RouteSegments out of them)
+    """
+    within = []
+    outside = []
+    for route_index, from_distance, to_distance, area in zip(segments.route_indexes, segments.from_distances, segments.to_distances, areas):
+        line = lines[route_index]
+        crossings = numpy.unique(get_boundary_crossings(line, shapely.boundary(area)))
+        crossings = crossings[(crossings > from_distance + DISTANCE_TOLERANCE) & (crossings < to_distance - DISTANCE_TOLERANCE)]
+        crossings = crossings[numpy.concatenate(([True], numpy.diff(crossings) > DISTANCE_TOLERANCE))] if len(crossings) else crossings
+        breaks = numpy.concatenate(([from_distance], crossings, [to_distance]))
+
+        covered = shapely.covers(area, shapely.line_interpolate_point(line, (breaks[:-1] + breaks[1:]) / 2.0))
+
+        # merge consecutive pieces on the same side of the area boundary
+        starts = numpy.concatenate(([0], numpy.flatnonzero(numpy.diff(covered)) + 1))
+        ends = numpy.concatenate((starts[1:], [len(covered)]))
+        for start, end in zip(starts, ends):
+            (within if covered[start] else outside).append((route_index, breaks[start], breaks[end]))
+
+    return to_route_segments(within), to_route_segments(outside)
+
+
+def get_boundary_crossings(line, boundary):
+    """
+    Distances along line of its intersections with an area boundary, from the line edges intersecting it.
+    """
+    coordinates = shapely.get_coordinates(line)
+    distances = numpy.concatenate(([0], numpy.cumsum(numpy.hypot(numpy.diff(coordinates[:, 0]), numpy.diff(coordinates[:, 1])))))
+    edges = shapely.linestrings(numpy.stack((coordinates[:-1], coordinates[1:]), axis=1))
+    edge_indexes = numpy.flatnonzero(shapely.intersects(edges, boundary))
+    if len(edge_indexes) == 0:
+        return numpy.array([])
+
+    points, point_indexes = shapely.get_coordinates(shapely.intersection(edges[edge_indexes], boundary), return_index=True)
+    edge_indexes = edge_indexes[point_indexes]
+    return distances[edge_indexes] + numpy.hypot(points[:, 0] - coordinates[edge_indexes, 0], points[:, 1] - coordinates[edge_indexes, 1])
+
+
+def to_route_segments(segments):
+    """
+    @param segments: [(route index, from distance, to distance)]
+    """
+    if not segments:
+        return RouteSegments(numpy.array([], dtype=numpy.int64), numpy.array([]), numpy.array([]))
+
+    route_indexes, from_distances, to_distances = zip(*segments)
+    return RouteSegments(numpy.array(route_indexes, dtype=numpy.int64), numpy.array(from_distances, dtype=float),
+                         numpy.array(to_distances, dtype=float))
+
+
+def get_segment_geometries(lines, segments):
+    return numpy.array([substring(lines[route_index], from_distance, to_distance)
+                        for route_index, from_distance, to_distance in zip(*segments)], dtype=object)
+
+
+def get_segment_endpoints(lines, segments):
+    """
+    @return: (x_first, y_first, x_last, y_last) of route segments, in route direction
+    """
+    first = shapely.get_coordinates(shapely.line_interpolate_point(lines[segments.route_indexes], segments.from_distances))
+    last = shapely.get_coordinates(shapely.line_interpolate_point(lines[segments.route_indexes], segments.to_distances))
+
+    return first[:, 0], first[:, 1], last[:, 0], last[:, 1]
+
+
+def group_by(keys, values):
+    """
+    Group values by keys of STRtree query results.
+    @return: [(key, values)]
+    """
+    if len(keys) == 0:
+        return []
+
+    order = numpy.argsort(keys, kind="stable")
+    keys = keys[order]
+    values = values[order]
+    starts = numpy.concatenate(([0], numpy.flatnonzero(numpy.diff(keys)) + 1))
+    ends = numpy.concatenate((starts[1:], [len(keys)]))
+
+    return [(keys[start], values[start:end]) for start, end in zip(starts, ends)]
+
+
+def read_features(workspace, dataset):
+    """
+    Features of a dataset in a GeoPackage or a folder of GeoJSON files.
+    @return: [(geometry, properties)]
+    """
+    if workspace.lower().endswith(".gpkg"):
+        if not fiona:
+            raise ImportError("fiona is required to read GeoPackage")
+        with fiona.open(workspace, layer=dataset) as collection:
+            return [(shape(feature["geometry"]), dict(feature["properties"])) for feature in collection]
+
+    with open(os.path.join(workspace, "{0}.geojson".format(dataset))) as geojson_file:
+        collection = json.load(geojson_file)
+
+    return [(shape(feature["geometry"]), feature.get("properties") or {}) for feature in collection["features"]]
+
+
+def read_rows(workspace, table, fields):
+    """
+    Rows of a table written by write_rows, dates parsed back.
+    """
+    rows = []
+    for geometry, properties in read_table(workspace, table):
+        row = []
+        for field in fields:
+            value = properties.get(field)
+            if field.endswith("_DT") and value:
+                value = parse_date(value)
+            row.append(value)
+        rows.append(tuple(row))
+
+    return rows
+
+
+def read_table(workspace, table):
+    """
+    Records of a table without geometry, as (None, properties).
+    """
+    if workspace.lower().endswith(".gpkg"):
+        if not fiona:
+            raise ImportError("fiona is required to read GeoPackage")
+        with fiona.open(workspace, layer=table) as collection:
+            return [(None, dict(feature["properties"])) for feature in collection]
+
+    with open(os.path.join(workspace, "{0}.geojson".format(table))) as geojson_file:
+        collection = json.load(geojson_file)
+
+    return [(None, feature.get("properties") or {}) for feature in collection["features"]]
+
+
+def write_rows(workspace, table, fields, rows):
+    """
+    Write rows as a table without geometry into a GeoPackage or a GeoJSON file.
+    """
+    records = [dict(zip(fields, [value.isoformat() if isinstance(value, datetime) else value for value in row])) for row in rows]
+
+    if workspace.lower().endswith(".gpkg"):
+        if not fiona:
+            raise ImportError("fiona is required to write GeoPackage")
+        schema = {"geometry": "None", "properties": collections.OrderedDict((field, "str") for field in fields)}
+        for field in ("ROUTE_START_MEASURE", "ROUTE_END_MEASURE"):
+            schema["properties"][field] = "float"
+        with fiona.open(workspace, "w", driver="GPKG", layer=table, schema=schema) as collection:
+            collection.writerecords({"geometry": None, "properties": record} for record in records)
+        return
+
+    with open(os.path.join(workspace, "{0}.geojson".format(table)), "w") as geojson_file:
+        json.dump({"type": "FeatureCollection",
+                   "features": [{"type": "Feature", "geometry": None, "properties": record} for record in records]}, geojson_file)
+
+
+def main():
+    from udot_border_route import setup_logger, get_parameters, run_with_report
+
+    setup_logger()
+    run_with_report(get_parameters(), "Default", run)
+
+
+if __name__ == "__main__":
+    main()